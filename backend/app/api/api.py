@@ -2,165 +2,60 @@
 API Route Handlers.
 This is where the main 'work' happens:
 1. Receives video IDs from the frontend.
-2. Fetches transcripts from YouTube.
-3. Fetches metadata (title, etc.) from YouTube.
-4. Sends everything to Gemini AI for summarization.
-5. Returns a structured JSON response.
+2. Fetches metadata and the transcript from YouTube side by side
+   (see services/pipeline.py).
+3. Sends everything to Gemini AI for summarization.
+4. Returns a structured JSON response.
 """
+import json
 import logging
-import os
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import Depends, APIRouter, HTTPException, Query
 from fastapi_limiter.depends import RateLimiter
-from fastapi.concurrency import run_in_threadpool
 import asyncio
-from youtube_transcript_api import NoTranscriptFound
-from app.core.cache import get_cached_or_fetch
-from app.services.youtube import get_video_metadata, get_safe_metadata
-from app.services.gemini import generate_structured_summary, chat_with_video, generate_summary_from_audio
-from app.services.audio import download_audio, cleanup_audio
-from app.utils.helpers import validate_video_id, format_transcript
-from app.core.config import RATE_LIMIT_TRANSCRIPT_TIMES, RATE_LIMIT_TRANSCRIPT_SECONDS
+from app.core.cache import get_cached_or_fetch, get_derived
+from app.services.youtube import get_videos_metadata
+from app.services.transcript import transcript_cache_key, get_prompt_text
+from app.services.extractors.router import fetch_transcript
+from app.services.pipeline import (
+    run_summary_pipeline,
+    stream_summary_events,
+    lookup_cached_results,
+    build_summary_response,
+    record_history,
+)
+from app.services.gemini import chat_with_video
+from app.services.retrieval import build_chat_index, select_context
+from app.services import jobs
+from app.utils.helpers import validate_video_id
+from app.core.config import (
+    RATE_LIMIT_TRANSCRIPT_TIMES,
+    RATE_LIMIT_TRANSCRIPT_SECONDS,
+    RATE_LIMIT_BATCH_TIMES,
+    RATE_LIMIT_BATCH_SECONDS,
+    BATCH_MAX_VIDEOS,
+    BATCH_CONCURRENCY,
+    CHAT_FULL_CONTEXT_CHARS,
+)
 from app.db import crud
+from app.core import metrics
+from app.core.auth import get_current_user, require_metrics_token
 from pydantic import BaseModel, EmailStr, Field
 from fastapi.responses import StreamingResponse
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-security = HTTPBearer()
-
-JWT_SECRET = os.getenv("JWT_SECRET", "super_secret_key_change_me_in_prod")
-ALGORITHM = "HS256"
-
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
-    """
-    Verifies the JWT token and returns the user_id.
-    """
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[ALGORITHM])
-        user_id_raw = payload.get("sub")
-        if not user_id_raw:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        user_id: str = str(user_id_raw)
-
-            
-        # Fire-and-forget sync to ensure the user exists in our DB
-        name = payload.get("name")
-        email = payload.get("email")
-        picture = payload.get("picture")
-        asyncio.create_task(crud.upsert_user(user_id, name, email, picture))
-        
-        return user_id
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
 
-async def fetch_youtube_transcript(video_id: str, lang: str = "en") -> tuple[list[dict], str]:
-    """
-    Directly interacts with the 'youtube_transcript_api' library.
-    Tries to find the requested language, or falls back to English/Auto.
-    """
-    max_retries = 3
-    cookies_path = os.path.join(os.getcwd(), "youtube_cookies.txt")
-    
-    for attempt in range(max_retries):
-        try:
-            # Manually handle cookies since the library version has them disabled
-            session = None
-            if os.path.exists(cookies_path):
-                logger.info(f"Loading cookies from {cookies_path}")
-                import requests
-                from http.cookiejar import MozillaCookieJar
-                
-                session = requests.Session()
-                cj = MozillaCookieJar(cookies_path)
-                try:
-                    cj.load(ignore_discard=True, ignore_expires=True)
-                    session.cookies = cj  # type: ignore
-                    logger.info("Cookies loaded successfully into session")
-                except Exception as e:
-                    logger.error(f"Failed to load cookies: {e}")
-                    session = None
-
-            # Initialize the API with our custom session if we have one
-            from youtube_transcript_api import YouTubeTranscriptApi
-            ytt_api = YouTubeTranscriptApi(http_client=session)
-            
-            # Use the instance method 'list' instead of class method 'list_transcripts'
-            transcript_list = await run_in_threadpool(ytt_api.list, video_id)
-            
-            if lang == "auto":
-                try:
-                    # Try English first (manual then auto-generated)
-                    transcript_obj = transcript_list.find_transcript(["en"])
-                except NoTranscriptFound:
-                    # Fallback to the first available transcript
-                    transcript_obj = next(iter(transcript_list))
-            else:
-                transcript_obj = transcript_list.find_transcript([lang])
-                
-            # Fetch the raw content
-            raw_data = await run_in_threadpool(transcript_obj.fetch)
-            
-            # CRITICAL: Ensure we have plain dictionaries for JSON serialization
-            clean_data = []
-            for seg in raw_data:
-                # Handle both dict-like and object-like segments
-                if isinstance(seg, dict):
-                    text = seg.get("text", "")
-                    start = seg.get("start", 0.0)
-                    duration = seg.get("duration", 0.0)
-                else:
-                    text = getattr(seg, "text", getattr(seg, "__getitem__", lambda x: "")("text"))
-                    start = getattr(seg, "start", getattr(seg, "__getitem__", lambda x: 0.0)("start"))
-                    duration = getattr(seg, "duration", getattr(seg, "__getitem__", lambda x: 0.0)("duration"))
-                
-                clean_data.append({
-                    "text": str(text),
-                    "start": float(start),
-                    "duration": float(duration)
-                })
-            
-            return clean_data, str(transcript_obj.language_code)
-        except Exception as e:
-            if attempt == max_retries - 1:
-                logger.warning(f"Transcript fetch failed for video {video_id}: {str(e)}")
-                raise HTTPException(
-                    status_code=404, detail="Transcript unavailable for this video"
-                )
-        await asyncio.sleep(1)
-    
-    raise HTTPException(status_code=404, detail="Transcript unavailable for this video")
+async def _finalize_result(video_id: str, target_lang: str, user_id: str, result: dict) -> dict:
+    """Records the summary in the user's history and builds the API response."""
+    await record_history(user_id, video_id, target_lang, result)
+    return build_summary_response(video_id, result)
 
 
-async def _process_audio_fallback(video_id: str, target_lang: str, metadata: dict) -> tuple[dict, list]:
-    """Helper to download and process audio when transcript is missing."""
-    audio_path = await get_cached_or_fetch(
-        f"audio_dl:{video_id}",
-        lambda v_id: __import__('asyncio').to_thread(download_audio, v_id),
-        video_id,
-        ttl=3600
-    )
-    
-    if not audio_path:
-        raise HTTPException(status_code=404, detail="No transcript available and audio download failed.")
-        
-    structured_data = await get_cached_or_fetch(
-        f"summary_audio:{video_id}:{target_lang}",
-        generate_summary_from_audio,
-        audio_path,
-        metadata.get("description", ""),
-        target_lang,
-        ttl=86400,
-    )
-    
-    transcript_data = [{"start": 0, "duration": 0, "text": "Transcript not available. Summary generated from audio."}]
-    __import__('asyncio').create_task(__import__('asyncio').to_thread(cleanup_audio, audio_path))
-    
-    return structured_data, transcript_data
-
 @router.get(
     "/transcript/{video_id}",
     dependencies=[
@@ -187,77 +82,195 @@ async def get_structured_transcript(
         raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        metadata = await get_video_metadata(video_id) or {}
-        safe_metadata = get_safe_metadata(video_id, metadata)
-
-        # Use a special cache key for auto to store the resolved data
-        transcript_str = ""
-        structured_data = None
-        
-        try:
-            transcript_data, detected_lang = await get_cached_or_fetch(
-                f"transcript:{video_id}:{lang}",
-                fetch_youtube_transcript,
-                video_id,
-                lang,
-                ttl=86400,
-            )
-            
-            transcript_str = await __import__('asyncio').to_thread(
-                lambda data: "\n".join(f"{seg['start']:.2f}s: {seg['text']}" for seg in data),
-                transcript_data
-            )
-            
-            structured_data = await get_cached_or_fetch(
-                f"summary:{video_id}:{detected_lang}:{target_lang}",
-                generate_structured_summary,
-                transcript_str,
-                metadata.get("description", ""),
-                target_lang,
-                ttl=86400,
-            )
-            
-        except (NoTranscriptFound, Exception):
-            logger.info(f"No transcript found for {video_id}. Falling back to audio processing.")
-            detected_lang = lang if lang != "auto" else "English"
-            
-            structured_data, transcript_data = await _process_audio_fallback(
-                video_id, target_lang, metadata
-            )
-
-        formatted_transcript = format_transcript(transcript_data)
-
-        # Save to history database
-        thumbnail = safe_metadata["thumbnail"]
-        await crud.create_history_record(
-            user_id=user_id,
-            video_id=video_id,
-            title=structured_data.get("title", "Untitled Video"),
-            thumbnail=thumbnail,
-            language=target_lang,
-            full_data=structured_data
-        )
-
-        return {
-            "video_id": video_id,
-            "language": detected_lang,
-            "full_transcript": formatted_transcript,
-            "total_segments": len(formatted_transcript),
-            "metadata": safe_metadata,
-            **structured_data,
-        }
+        result = await run_summary_pipeline(video_id, lang, target_lang, user_id=user_id)
+        return await _finalize_result(video_id, target_lang, user_id, result)
     except HTTPException:
         raise
     except Exception:
         logger.exception(f"Unexpected error processing video {video_id}")
         raise HTTPException(status_code=500, detail="An error occurred while processing your request")
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get(
+    "/transcript/{video_id}/stream",
+    dependencies=[
+        Depends(
+            RateLimiter(
+                times=RATE_LIMIT_TRANSCRIPT_TIMES, seconds=RATE_LIMIT_TRANSCRIPT_SECONDS
+            )
+        )
+    ],
+)
+async def stream_structured_transcript(
+    video_id: str,
+    lang: str = Query("auto", description="Transcript language code. Use 'auto' for detection."),
+    target_lang: str = Query("English", description="Language for the generated summary."),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Streaming variant of GET /transcript/{video_id} (Server-Sent Events).
+    Sends 'metadata', 'transcript', then 'summary_field' events as Gemini
+    writes the summary, and finally 'done' (or 'error').
+    """
+    try:
+        validate_video_id(video_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def event_stream():
+        async for event, data in stream_summary_events(video_id, lang, target_lang, user_id):
+            yield _sse_event(event, data)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+class BatchRequest(BaseModel):
+    video_ids: list[str] = Field(..., min_length=1, max_length=BATCH_MAX_VIDEOS)
+    lang: str = "auto"
+    target_lang: str = "English"
+
+
+@router.post(
+    "/transcripts/batch",
+    dependencies=[
+        Depends(
+            RateLimiter(times=RATE_LIMIT_BATCH_TIMES, seconds=RATE_LIMIT_BATCH_SECONDS)
+        )
+    ],
+)
+async def get_structured_transcripts_batch(request: BatchRequest, user_id: str = Depends(get_current_user)):
+    """
+    Summarizes up to 50 videos (e.g. a playlist) in one request.
+    Metadata comes from one batched YouTube call, cached results from batched
+    cache lookups, and only the misses run the pipeline (with bounded concurrency).
+    Streams one 'video' SSE event per video as it completes, then 'done'.
+    """
+    video_ids = list(dict.fromkeys(request.video_ids))
+    try:
+        for video_id in video_ids:
+            validate_video_id(video_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}: {video_id}")
+
+    metadata = await get_videos_metadata(video_ids)
+    cached_results = await lookup_cached_results(video_ids, request.lang, request.target_lang, metadata)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def process(video_id: str) -> dict:
+        try:
+            result = cached_results.get(video_id)
+            if result is None:
+                async with semaphore:
+                    result = await run_summary_pipeline(
+                        video_id, request.lang, request.target_lang, user_id=user_id
+                    )
+            response = await _finalize_result(video_id, request.target_lang, user_id, result)
+            return {"status": "ok", **response}
+        except HTTPException as e:
+            return {"video_id": video_id, "status": "error", "detail": e.detail}
+        except Exception:
+            logger.exception(f"Unexpected error processing video {video_id} in batch")
+            return {"video_id": video_id, "status": "error", "detail": "An error occurred while processing this video"}
+
+    async def event_stream():
+        tasks = [asyncio.create_task(process(video_id)) for video_id in video_ids]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                succeeded += item["status"] == "ok"
+                yield _sse_event("video", item)
+            yield _sse_event("done", {"total": len(video_ids), "succeeded": succeeded, "cached": len(cached_results)})
+        finally:
+            # Client went away - stop the remaining work
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+class JobRequest(BaseModel):
+    video_id: str
+    lang: str = "auto"
+    target_lang: str = "English"
+
+
+@router.post(
+    "/jobs",
+    status_code=202,
+    dependencies=[
+        Depends(
+            RateLimiter(
+                times=RATE_LIMIT_TRANSCRIPT_TIMES, seconds=RATE_LIMIT_TRANSCRIPT_SECONDS
+            )
+        )
+    ],
+)
+async def create_summary_job(request: JobRequest, user_id: str = Depends(get_current_user)):
+    """
+    Queues a summary to run in the background (for long videos / audio fallback).
+    Poll GET /jobs/{job_id} for progress and the result.
+    """
+    try:
+        validate_video_id(request.video_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not jobs.jobs_available():
+        raise HTTPException(status_code=503, detail="Background jobs are unavailable")
+
+    job = await jobs.enqueue_job(user_id, request.video_id, request.lang, request.target_lang)
+    job.pop("result", None)
+    return job
+
+@router.get("/jobs/{job_id}")
+async def get_summary_job(job_id: str, user_id: str = Depends(get_current_user)):
+    """Reports a job's status and progress, plus the summary once it has completed."""
+    if not jobs.jobs_available():
+        raise HTTPException(status_code=503, detail="Background jobs are unavailable")
+    job = await jobs.get_job(job_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _parse_history_cursor(before: str) -> tuple[datetime, ObjectId]:
+    created_at, _, record_id = before.rpartition(",")
+    try:
+        return datetime.fromisoformat(created_at), ObjectId(record_id)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
 @router.get("/history")
-async def get_recent_summaries(user_id: str = Depends(get_current_user)):
-    """Fetches the 10 most recently summarized videos for the user."""
-    history = await crud.get_recent_history(user_id=user_id, limit=10)
+async def get_recent_summaries(
+    limit: int = Query(10, ge=1, le=50),
+    before: str | None = Query(None, description="Cursor '<created_at>,<_id>' of the last record of the previous page."),
+    user_id: str = Depends(get_current_user),
+):
+    """
+    Fetches the user's most recently summarized videos (newest first, without the summaries).
+    For the next page pass before=<created_at>,<_id> of the last record.
+    """
+    cursor = _parse_history_cursor(before) if before else None
+    history = await crud.get_recent_history(user_id=user_id, limit=limit, before=cursor)
     return history
 
+@router.get("/history/{video_id}")
+async def get_history_summary(
+    video_id: str,
+    language: str | None = Query(None, description="Summary language; the latest one if omitted."),
+    user_id: str = Depends(get_current_user),
+):
+    """Loads one saved summary from the user's history."""
+    record = await crud.get_history_record(user_id, video_id, language)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Summary not found in history")
+    return record
+
+@router.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    """Reports this worker's cache and service counters (operators only, see METRICS_TOKEN)."""
+    return metrics.snapshot()
+
 class ChatRequest(BaseModel):
     question: str
     lang: str = "auto"
@@ -272,21 +285,34 @@ async def chat_video(video_id: str, request: ChatRequest, user_id: str = Depends
         
         # Try to get the transcript from cache or re-fetch it
         transcript_data, detected_lang = await get_cached_or_fetch(
-            f"transcript:{video_id}:{request.lang}",
-            fetch_youtube_transcript,
+            transcript_cache_key(video_id, request.lang),
+            fetch_transcript,
             video_id,
             request.lang,
             ttl=86400,
+            durable=True,
         )
         
-        transcript_str = await __import__('asyncio').to_thread(
-            lambda data: "\n".join(f"{seg['start']:.2f}s: {seg['text']}" for seg in data),
-            transcript_data
-        )
+        # Send only the windows relevant to the question when we can find them confidently
+        context = None
+        if sum(len(seg["text"]) for seg in transcript_data) > CHAT_FULL_CONTEXT_CHARS:
+            index = await get_derived(
+                transcript_cache_key(video_id, request.lang),
+                "chat_index",
+                build_chat_index,
+                transcript_data,
+                ttl=86400,
+            )
+            context = select_context(index, request.question)
+        context_is_excerpts = context is not None
+        metrics.incr("chat.context.retrieval" if context_is_excerpts else "chat.context.full")
+
+        if not context_is_excerpts:
+            context = await get_prompt_text(video_id, request.lang, transcript_data)
         
         # Stream the response
         return StreamingResponse(
-            chat_with_video(transcript_str, request.question),
+            chat_with_video(context, request.question, excerpts=context_is_excerpts),
             media_type="text/event-stream"
         )
         
@@ -0,0 +1,95 @@
+"""
+Authentication.
+Verifies the bearer JWTs sent by the frontend and resolves them to a user id.
+
+The frontend sends the same token with every request for its whole lifetime,
+so verified claims are kept in a small in-process cache keyed by the token's
+SHA-256 digest (the raw token is never stored) until the token's 'exp'.
+
+Operational endpoints such as /metrics use a separate static METRICS_TOKEN.
+"""
+import hashlib
+import logging
+import secrets
+import time
+from typing import Any, Dict
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from jose import jwt, JWTError
+from app.core import metrics
+from app.core.config import JWT_SECRET, JWT_CACHE_MAX_ENTRIES, JWT_CACHE_MAX_TTL_SECONDS, METRICS_TOKEN
+from app.core.memory_cache import MemoryLRUCache
+from app.db import user_activity
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+
+security = HTTPBearer()
+
+# Every entry counts as size 1, so the byte bound is an entry bound
+_verified_tokens = MemoryLRUCache(max_bytes=JWT_CACHE_MAX_ENTRIES, max_ttl=JWT_CACHE_MAX_TTL_SECONDS)
+
+metrics.register_gauge("auth.token_cache.entries", lambda: len(_verified_tokens))
+
+
+def _invalid_credentials() -> HTTPException:
+    return HTTPException(status_code=401, detail="Invalid authentication credentials")
+
+
+def verify_token(token: str) -> Dict[str, Any]:
+    """
+    Returns the claims of a valid token, from the cache when it was verified before.
+    Raises a 401 HTTPException otherwise. The claims are shared: don't modify them.
+    """
+    started = time.perf_counter()
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = _verified_tokens.get(digest)
+    if claims is not None:
+        metrics.incr("auth.token_cache.hit")
+    else:
+        metrics.incr("auth.token_cache.miss")
+        try:
+            claims = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
+        except JWTError:
+            metrics.incr("auth.rejected")
+            raise _invalid_credentials()
+        if not claims.get("sub"):
+            metrics.incr("auth.rejected")
+            raise _invalid_credentials()
+        # Tokens without 'exp' never expire, so they just stay for the maximum TTL
+        expires_at = claims.get("exp")
+        ttl = expires_at - time.time() if isinstance(expires_at, (int, float)) else JWT_CACHE_MAX_TTL_SECONDS
+        _verified_tokens.set(digest, claims, size=1, ttl=ttl)
+    metrics.observe("auth.verify_seconds", time.perf_counter() - started)
+    return claims
+
+
+def authenticate(token: str) -> str:
+    """
+    Resolves a bearer token to a user id and notes the user's activity.
+    Usable outside of the HTTP dependency, e.g. for a token sent over a WebSocket.
+    """
+    claims = verify_token(token)
+    user_id = str(claims["sub"])
+    # Batched, debounced sync to ensure the user exists in our DB
+    user_activity.record_activity(user_id, claims.get("name"), claims.get("email"), claims.get("picture"))
+    return user_id
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """
+    Verifies the JWT token and returns the user_id.
+    """
+    return authenticate(credentials.credentials)
+
+
+async def require_metrics_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Guards operational endpoints with the METRICS_TOKEN bearer token.
+    They don't exist (404) unless a token is configured.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(credentials.credentials.encode("utf-8"), METRICS_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Not authorized")
@@ -1,66 +1,627 @@
 """
 Redis Caching Module.
 Implements the 'Get or Fetch' pattern to reduce API costs and improve speed.
+
+Concurrent misses on the same key are coalesced ("single-flight"): inside one
+process all callers share a single fetch task, and across workers a short Redis
+lease makes sure only one of them calls the upstream API while the others wait
+for the cached result.
+
+Reads go through a per-process L1 (see memory_cache.py) before Redis. Writes
+are announced on a Redis pub/sub channel so other workers drop stale L1 copies.
+
+Values are stored as bytes produced by the configured codec (see codec.py),
+on a separate binary connection; the text connection is kept for leases,
+pub/sub and the rate limiter.
+
+Keys can also have a soft TTL (stale-while-revalidate): once a value is older
+than 'soft_ttl' it is still served immediately, but one background refresh is
+started. Refreshes are also triggered probabilistically a little before the
+soft TTL ("XFetch"), weighted by how long the fetch usually takes, so hot keys
+written at the same moment don't all go stale on the same tick.
+
+Keys fetched with durable=True (transcripts, summaries) are also kept in the
+MongoDB artifact store (see db/artifacts.py) as a third tier: a Redis miss
+reads through to it before calling the upstream API, and new values are written
+behind to it in the background.
 """
-import json
+import asyncio
 import logging
+import math
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, NamedTuple
 import redis.asyncio as redis
-from app.core.config import REDIS_URL
+from fastapi import HTTPException
+from app.core import metrics
+from app.core.codec import get_codec, decode_sized
+from app.core.memory_cache import MemoryLRUCache
+from app.db.artifacts import load_artifact, save_artifact, delete_artifacts, touch_artifact
+from app.core.config import (
+    REDIS_URL,
+    CACHE_LOCK_TTL_SECONDS,
+    CACHE_LOCK_WAIT_SECONDS,
+    L1_CACHE_MAX_BYTES,
+    L1_CACHE_TTL_SECONDS,
+    CACHE_INVALIDATION_CHANNEL,
+    CACHE_CODEC,
+    CACHE_COMPRESSION,
+    CACHE_EARLY_REFRESH_BETA,
+)
 
 logger = logging.getLogger(__name__)
 
 redis_client = None
+binary_client = None
+_invalidation_task = None
+
+codec = get_codec(CACHE_CODEC, CACHE_COMPRESSION)
+
+# Per-process L1 tier and the id we tag our invalidation messages with
+l1_cache = MemoryLRUCache(max_bytes=L1_CACHE_MAX_BYTES, max_ttl=L1_CACHE_TTL_SECONDS)
+_INSTANCE_ID = uuid.uuid4().hex
+
+metrics.register_gauge("cache.l1.entries", lambda: len(l1_cache))
+metrics.register_gauge("cache.l1.bytes", lambda: l1_cache.current_bytes)
+
+# Fetches currently running in this process, keyed by cache key
+_inflight: dict[str, asyncio.Task] = {}
+
+# Background stale-while-revalidate refreshes running in this process
+_refreshing: set[str] = set()
+_background_tasks: set[asyncio.Task] = set()
+# Pending write-behind saves to the artifact store (drained on shutdown)
+_durable_writes: set[asyncio.Task] = set()
+
+# Moving average of fetch durations per key family ("summary", "transcript", ...)
+_fetch_seconds: dict[str, float] = {}
+
+# Sentinel for "nothing cached" (None is a valid cached value)
+_MISS = object()
+
+
+class _Cached(NamedTuple):
+    value: Any
+    expires_at: float | None  # wall-clock hard expiry of the Redis copy
+
+
+# Only delete the lease if we still own it (it may have expired and been re-taken)
+_RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Extend the lease, again only if we still own it
+_RENEW_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
 
 
 async def init_redis():
     """Establishes connection to the Redis server for caching."""
-    global redis_client
+    global redis_client, binary_client, _invalidation_task
     if not REDIS_URL:
         logger.warning("Redis URL not configured - caching disabled")
         return
     try:
         redis_client = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+        binary_client = redis.from_url(REDIS_URL, decode_responses=False)
         # Test connection
         await redis_client.ping()
-        logger.info("Redis connection established successfully")
+        logger.info(f"Redis connection established successfully (cache codec: {codec.name})")
     except Exception as e:
         logger.error(f"Failed to connect to Redis: {e}")
         redis_client = None
+        binary_client = None
+        return
+    _invalidation_task = asyncio.create_task(_listen_for_invalidations())
 
 
 async def close_redis():
-    global redis_client
+    global redis_client, binary_client, _invalidation_task
+    for task in list(_background_tasks):
+        task.cancel()
+    if _durable_writes:
+        await asyncio.wait(list(_durable_writes), timeout=5)
+    if _invalidation_task:
+        _invalidation_task.cancel()
+        try:
+            await _invalidation_task
+        except asyncio.CancelledError:
+            pass
+        _invalidation_task = None
     if redis_client:
         await redis_client.close()
+        await binary_client.close()
         logger.info("Redis connection closed")
 
 
-async def get_cached_or_fetch(cache_key, fetch_function, *args, ttl=3600):
+async def _listen_for_invalidations():
     """
-    Checks Redis for a key. If found, returns it. 
-    If NOT found, runs 'fetch_function', saves the result to Redis, and returns it.
+    Drops L1 entries that another worker has rewritten or invalidated.
+    If the subscription breaks we may have missed messages, so the L1 is cleared.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                sender, _, key = message["data"].partition(":")
+                if sender != _INSTANCE_ID:
+                    l1_cache.delete(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Cache invalidation subscription lost, clearing L1: {e}")
+            l1_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+async def _publish_invalidation(cache_key):
+    try:
+        await redis_client.publish(CACHE_INVALIDATION_CHANNEL, f"{_INSTANCE_ID}:{cache_key}")
+    except Exception as e:
+        logger.warning(f"Failed to publish cache invalidation for {cache_key}: {e}")
+
+
+async def _read_cache(cache_key):
+    """Returns the cached entry (_Cached) for a key, or _MISS."""
+    entry = l1_cache.get(cache_key, _MISS)
+    if entry is not _MISS:
+        metrics.incr("cache.l1.hit")
+        return entry
+    metrics.incr("cache.l1.miss")
+
+    if not redis_client:
+        return _MISS
+    try:
+        async with binary_client.pipeline(transaction=False) as pipe:
+            cached, ttl_ms = await pipe.get(cache_key).pttl(cache_key).execute()
+        if cached:
+            logger.debug(f"Cache hit for key: {cache_key}")
+            metrics.incr("cache.redis.hit")
+            value, size = decode_sized(cached)
+            if ttl_ms and ttl_ms > 0:
+                entry = _Cached(value, time.time() + ttl_ms / 1000)
+                l1_cache.set(cache_key, entry, size, ttl_ms / 1000)
+            else:
+                entry = _Cached(value, None)
+            return entry
+        metrics.incr("cache.redis.miss")
+    except ValueError:
+        # Old pickle data or corrupted cache - delete and re-fetch
+        logger.warning(f"Corrupted cache entry for key: {cache_key}, deleting")
+        await redis_client.delete(cache_key)
+    except Exception as e:
+        logger.warning(f"Redis get failed, proceeding without cache: {e}")
+    return _MISS
+
+
+def _write_behind(cache_key, payload, size):
+    task = asyncio.create_task(save_artifact(cache_key, payload, size))
+    _durable_writes.add(task)
+    task.add_done_callback(_durable_writes.discard)
+
+
+async def _read_durable(cache_key):
+    """Returns the value kept in the artifact store for a key, or _MISS."""
+    data = await load_artifact(cache_key)
+    if data is None:
+        metrics.incr("cache.l3.miss")
+        return _MISS
+    try:
+        value, _ = decode_sized(data)
+    except ValueError:
+        logger.warning(f"Corrupted artifact for key: {cache_key}, ignoring")
+        return _MISS
+    metrics.incr("cache.l3.hit")
+    return value
+
+
+async def _write_cache(cache_key, result, ttl, durable=False):
+    if not redis_client and not durable:
+        return
+    try:
+        payload, size = codec.encode_sized(result)
+    except Exception as e:
+        logger.warning(f"Failed to encode result for {cache_key}: {e}")
+        return
+    if durable:
+        _write_behind(cache_key, payload, size)
+    if not redis_client:
+        return
+    try:
+        # Also collects the artifacts derived from the old value (see get_derived)
+        async with binary_client.pipeline(transaction=False) as pipe:
+            pipe.setex(cache_key, ttl, payload)
+            pipe.smembers(f"derived_keys:{cache_key}")
+            _, derived_keys = await pipe.execute()
+        logger.debug(f"Cached result for key: {cache_key} ({len(payload)} bytes)")
+    except Exception as e:
+        logger.warning(f"Failed to cache result: {e}")
+        return
+    l1_cache.set(cache_key, _Cached(result, time.time() + ttl), size, ttl)
+    await _publish_invalidation(cache_key)
+    if derived_keys:
+        await _delete_derived(cache_key, [key.decode("utf-8") for key in derived_keys])
+
+
+async def _delete_derived(source_key, derived_keys):
+    """Drops the artifacts derived from a value that was just rewritten."""
+    try:
+        await redis_client.delete(*derived_keys, f"derived_keys:{source_key}")
+    except Exception as e:
+        logger.warning(f"Failed to delete artifacts derived from {source_key}: {e}")
+    for key in derived_keys:
+        l1_cache.delete(key)
+        await _publish_invalidation(key)
+
+
+async def set_cached(cache_key, value, ttl=3600, durable=False):
+    """Stores a value directly (for results produced outside get_cached_or_fetch)."""
+    await _write_cache(cache_key, value, ttl, durable)
+
+
+async def get_many_cached(cache_keys, durable=False) -> dict:
+    """
+    Looks up several keys at once (L1 first, then a single Redis pipeline).
+    Returns {key: value} for the keys that were found. With 'durable', hits
+    count as uses of the keys' artifacts (the artifact store isn't read).
+    """
+    found = await _get_many(cache_keys)
+    if durable:
+        for key in found:
+            touch_artifact(key)
+    return found
+
+
+async def _get_many(cache_keys) -> dict:
+    found = {}
+    remote_keys = []
+    for key in cache_keys:
+        entry = l1_cache.get(key, _MISS)
+        if entry is _MISS:
+            remote_keys.append(key)
+        else:
+            found[key] = entry.value
+    metrics.incr("cache.l1.hit", len(found))
+    metrics.incr("cache.l1.miss", len(remote_keys))
+
+    if not redis_client or not remote_keys:
+        return found
+    try:
+        async with binary_client.pipeline(transaction=False) as pipe:
+            for key in remote_keys:
+                pipe.get(key).pttl(key)
+            replies = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Redis batch get failed, proceeding without cache: {e}")
+        return found
+
+    for key, cached, ttl_ms in zip(remote_keys, replies[::2], replies[1::2]):
+        if not cached:
+            metrics.incr("cache.redis.miss")
+            continue
+        try:
+            value, size = decode_sized(cached)
+        except ValueError:
+            logger.warning(f"Corrupted cache entry for key: {key}, ignoring")
+            continue
+        metrics.incr("cache.redis.hit")
+        if ttl_ms and ttl_ms > 0:
+            l1_cache.set(key, _Cached(value, time.time() + ttl_ms / 1000), size, ttl_ms / 1000)
+        found[key] = value
+    return found
+
+
+async def invalidate(cache_key):
     """
+    Removes a key from Redis and from the L1 of every worker,
+    together with any artifacts derived from it (see get_derived).
+    """
+    l1_cache.delete(cache_key)
+    if not redis_client:
+        await delete_artifacts([cache_key])
+        return
+    keys = [cache_key]
+    try:
+        keys += await redis_client.smembers(f"derived_keys:{cache_key}")
+        await redis_client.delete(*keys, f"derived_keys:{cache_key}")
+    except Exception as e:
+        logger.warning(f"Failed to delete cache key {cache_key}: {e}")
+    await delete_artifacts(keys)
+    for key in keys:
+        l1_cache.delete(key)
+        await _publish_invalidation(key)
+
+
+async def get_derived(source_key, name, build_function, source_value, ttl=3600):
+    """
+    Returns an artifact computed from a cached value, e.g. the prompt-ready text
+    of a transcript. It is built once (in a worker thread, 'build_function' is
+    synchronous), cached under 'derived:{name}:{source_key}' and shared by all
+    endpoints and workers. It never outlives the source value: it expires with
+    it, and rewriting or invalidating the source key drops it as well.
+    """
+    derived_key = f"derived:{name}:{source_key}"
+    entry = await _read_cache(derived_key)
+    if entry is not _MISS:
+        return entry.value
     if redis_client:
         try:
-            cached = await redis_client.get(cache_key)
-            if cached:
-                logger.debug(f"Cache hit for key: {cache_key}")
-                return json.loads(cached)
-        except (UnicodeDecodeError, json.JSONDecodeError):
-            # Old pickle data or corrupted cache - delete and re-fetch
-            logger.warning(f"Corrupted cache entry for key: {cache_key}, deleting")
-            await redis_client.delete(cache_key)
+            source_ttl_ms = await redis_client.pttl(source_key)
+            if source_ttl_ms > 0:
+                ttl = max(1, min(ttl, source_ttl_ms // 1000))
+        except Exception as e:
+            logger.warning(f"Failed to read the TTL of {source_key}: {e}")
+
+    async def build(value):
+        artifact = await asyncio.to_thread(build_function, value)
+        if redis_client:
+            try:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.sadd(f"derived_keys:{source_key}", derived_key)
+                    pipe.expire(f"derived_keys:{source_key}", ttl)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to register derived key {derived_key}: {e}")
+        return artifact
+
+    return await get_cached_or_fetch(derived_key, build, source_value, ttl=ttl)
+
+
+async def _acquire_lease(cache_key):
+    """
+    Tries to take the cross-worker fetch lease for a key.
+    Returns the lease token if we got it, None if another worker holds it,
+    and an empty string if Redis failed (we then fetch without a lease).
+    """
+    token = uuid.uuid4().hex
+    try:
+        acquired = await redis_client.set(f"lock:{cache_key}", token, nx=True, ex=CACHE_LOCK_TTL_SECONDS)
+        return token if acquired else None
+    except Exception as e:
+        logger.warning(f"Failed to acquire cache lease for {cache_key}: {e}")
+        return ""
+
+
+async def _release_lease(cache_key, token):
+    try:
+        await redis_client.eval(_RELEASE_LEASE_SCRIPT, 1, f"lock:{cache_key}", token)
+    except Exception as e:
+        logger.warning(f"Failed to release cache lease for {cache_key}: {e}")
+
+
+async def _keep_lease(cache_key, token):
+    """Extends our lease while the fetch runs, so a slow fetch doesn't lose it halfway."""
+    while True:
+        await asyncio.sleep(CACHE_LOCK_TTL_SECONDS / 3)
+        try:
+            renewed = await redis_client.eval(
+                _RENEW_LEASE_SCRIPT, 1, f"lock:{cache_key}", token, CACHE_LOCK_TTL_SECONDS
+            )
         except Exception as e:
-            logger.warning(f"Redis get failed, proceeding without cache: {e}")
+            logger.warning(f"Failed to renew cache lease for {cache_key}: {e}")
+            continue
+        if not renewed:
+            logger.warning(f"Lost the cache lease for {cache_key} during the fetch")
+            return
 
-    # Execute the fetch function (it must be async)
-    result = await fetch_function(*args)
 
+@asynccontextmanager
+async def _holding_lease(cache_key, token):
+    """Keeps the lease alive for the duration of the block and releases it after."""
+    renewer = asyncio.create_task(_keep_lease(cache_key, token)) if token else None
+    try:
+        yield
+    finally:
+        if renewer:
+            renewer.cancel()
+        if token:
+            await _release_lease(cache_key, token)
+
+
+async def _wait_for_peer(cache_key, deadline):
+    """
+    Polls until the worker holding the lease has cached its result.
+    Gives up (returning _MISS) if the lease disappears without a value
+    or the deadline passes.
+    """
+    loop = asyncio.get_running_loop()
+    delay = 0.05
+    while loop.time() < deadline:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+        entry = await _read_cache(cache_key)
+        if entry is not _MISS:
+            return entry.value
+        try:
+            if not await redis_client.exists(f"lock:{cache_key}"):
+                # Peer finished without caching (e.g. its fetch failed); one last look
+                entry = await _read_cache(cache_key)
+                return entry.value if entry is not _MISS else _MISS
+        except Exception:
+            return _MISS
+    return _MISS
+
+
+async def _lease_or_peer_result(cache_key):
+    """
+    Takes the fetch lease for a key, or waits for the worker that holds it.
+    Returns (lease, _MISS) once we hold the lease, or (None, value) with the
+    peer's result. If a peer gives up without a result, the waiting workers
+    compete for the lease again, so only one of them fetches next. Raises a
+    503 if no result shows up within CACHE_LOCK_WAIT_SECONDS.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CACHE_LOCK_WAIT_SECONDS
+    while True:
+        lease = await _acquire_lease(cache_key)
+        if lease is not None:
+            return lease, _MISS
+        logger.debug(f"Waiting for another worker to fetch {cache_key}")
+        cached = await _wait_for_peer(cache_key, deadline)
+        if cached is not _MISS:
+            return None, cached
+        if loop.time() >= deadline:
+            metrics.incr("cache.lease.wait_timeout")
+            logger.warning(f"Timed out waiting for peer fetch of {cache_key}")
+            raise HTTPException(
+                status_code=503,
+                detail="This result is still being prepared, please try again shortly",
+                headers={"Retry-After": "10"},
+            )
+
+
+async def _fetch_once(cache_key, fetch_function, args, ttl, durable):
+    """Runs the fetch for a key at most once across workers and caches the result."""
+    lease = None
     if redis_client:
+        lease, cached = await _lease_or_peer_result(cache_key)
+        if cached is not _MISS:
+            return cached
+    async with _holding_lease(cache_key, lease):
+        if durable:
+            stored = await _read_durable(cache_key)
+            if stored is not _MISS:
+                await _write_cache(cache_key, stored, ttl)
+                return stored
+        # Execute the fetch function (it must be async)
+        started = time.monotonic()
+        result = await fetch_function(*args)
+        _record_fetch_time(cache_key, time.monotonic() - started)
+        await _write_cache(cache_key, result, ttl, durable)
+        return result
+
+
+def _record_fetch_time(cache_key, seconds):
+    family = cache_key.split(":", 1)[0]
+    previous = _fetch_seconds.get(family)
+    _fetch_seconds[family] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+
+def _needs_refresh(cache_key, entry, ttl, soft_ttl):
+    """
+    Decides whether a cached value should be refreshed in the background.
+    The write time is derived from the remaining Redis TTL, so no extra
+    metadata has to be stored next to the value.
+    """
+    if soft_ttl is None or entry.expires_at is None:
+        return False
+    fresh_until = entry.expires_at - ttl + soft_ttl
+    # XFetch: refresh early with a probability that rises as the soft TTL approaches
+    fetch_seconds = _fetch_seconds.get(cache_key.split(":", 1)[0], 1.0)
+    jitter = -fetch_seconds * CACHE_EARLY_REFRESH_BETA * math.log(1.0 - random.random())
+    return time.time() + jitter >= fresh_until
+
+
+async def _refresh(cache_key, fetch_function, args, ttl, durable):
+    """Background refresh; skipped if another worker already holds the fetch lease."""
+    lease = None
+    if redis_client:
+        lease = await _acquire_lease(cache_key)
+        if lease is None:
+            return
+    async with _holding_lease(cache_key, lease):
         try:
-            await redis_client.setex(cache_key, ttl, json.dumps(result))
-            logger.debug(f"Cached result for key: {cache_key}")
+            started = time.monotonic()
+            result = await fetch_function(*args)
+            _record_fetch_time(cache_key, time.monotonic() - started)
+            await _write_cache(cache_key, result, ttl, durable)
+            metrics.incr("cache.refresh.ok")
         except Exception as e:
-            logger.warning(f"Failed to cache result: {e}")
+            # The stale value stays in place until its hard TTL
+            metrics.incr("cache.refresh.failed")
+            logger.warning(f"Background refresh failed for {cache_key}: {e}")
+
+
+def _schedule_refresh(cache_key, fetch_function, args, ttl, durable):
+    if cache_key in _refreshing or cache_key in _inflight:
+        return
+    _refreshing.add(cache_key)
+    task = asyncio.create_task(_refresh(cache_key, fetch_function, args, ttl, durable))
+    _background_tasks.add(task)
+
+    def _forget(done_task, key=cache_key):
+        _refreshing.discard(key)
+        _background_tasks.discard(done_task)
+
+    task.add_done_callback(_forget)
+
+
+def _serve_hit(cache_key, entry, fetch_function, args, ttl, soft_ttl, durable):
+    if durable:
+        touch_artifact(cache_key)
+    if _needs_refresh(cache_key, entry, ttl, soft_ttl):
+        metrics.incr("cache.refresh.scheduled")
+        _schedule_refresh(cache_key, fetch_function, args, ttl, durable)
+    return entry.value
+
+
+async def peek_cached(cache_key, fetch_function, *args, ttl=3600, soft_ttl=None, durable=False, default=None):
+    """
+    Like get_cached_or_fetch, but returns 'default' on a miss instead of fetching,
+    for callers that produce the value themselves (e.g. by streaming it).
+    Stale values still get their background refresh (with 'fetch_function'),
+    and with 'durable' a Redis miss still reads through to the artifact store.
+    """
+    entry = await _read_cache(cache_key)
+    if entry is not _MISS:
+        return _serve_hit(cache_key, entry, fetch_function, args, ttl, soft_ttl, durable)
+    if durable:
+        stored = await _read_durable(cache_key)
+        if stored is not _MISS:
+            await _write_cache(cache_key, stored, ttl)
+            return stored
+    return default
+
+
+async def get_cached_or_fetch(cache_key, fetch_function, *args, ttl=3600, soft_ttl=None, durable=False):
+    """
+    Checks Redis for a key. If found, returns it.
+    If NOT found, runs 'fetch_function', saves the result to Redis, and returns it.
+    Concurrent callers for the same key share one fetch.
+
+    With 'soft_ttl' (< ttl), values older than soft_ttl are served stale while
+    a single background refresh runs; 'ttl' is then the hard expiry.
+
+    With 'durable', a Redis miss is looked up in the artifact store before
+    fetching, and fetched values are saved there too.
+    """
+    entry = await _read_cache(cache_key)
+    if entry is not _MISS:
+        return _serve_hit(cache_key, entry, fetch_function, args, ttl, soft_ttl, durable)
+
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_fetch_once(cache_key, fetch_function, args, ttl, durable))
+        _inflight[cache_key] = task
+
+        def _forget(done_task, key=cache_key):
+            if _inflight.get(key) is done_task:
+                del _inflight[key]
+            # Mark a failure as retrieved even if every waiter went away
+            if not done_task.cancelled():
+                done_task.exception()
+
+        task.add_done_callback(_forget)
+    else:
+        logger.debug(f"Joining in-flight fetch for key: {cache_key}")
 
-    return result
+    # Shield so a disconnecting caller doesn't cancel the fetch other callers are waiting on
+    return await asyncio.shield(task)
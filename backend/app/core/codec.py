@@ -0,0 +1,199 @@
+"""
+Cache Value Codecs.
+Turns cached values into compact bytes for Redis and back again.
+
+Every encoded value starts with a version byte so the format can evolve:
+  1 - compressed JSON (summaries, metadata, anything generic)
+  2 - compressed columnar transcript: packed start/duration float arrays,
+      one concatenated UTF-8 text blob and the offsets into it
+Values written before codecs existed are plain JSON text; they start with a
+printable character and are still decoded as JSON.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency - fall back to zlib
+    zstandard = None
+
+VERSION_JSON = 1
+VERSION_TRANSCRIPT = 2
+
+COMPRESSION_ZLIB = 0
+COMPRESSION_ZSTD = 1
+
+_SEGMENT_KEYS = {"text", "start", "duration"}
+
+# flags, segment count, language length
+_TRANSCRIPT_HEADER = struct.Struct("<BIH")
+_FLAG_HAS_LANGUAGE = 1
+
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _pack(values: array) -> bytes:
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def _is_segment_list(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) > 0
+        and all(
+            type(seg) is dict
+            and seg.keys() == _SEGMENT_KEYS
+            and isinstance(seg["text"], str)
+            and isinstance(seg["start"], (int, float))
+            and isinstance(seg["duration"], (int, float))
+            for seg in value
+        )
+    )
+
+
+def _encode_transcript(segments: list, language: str | None) -> bytes:
+    language_bytes = (language or "").encode("utf-8")
+    texts = [seg["text"].encode("utf-8") for seg in segments]
+
+    offsets = array("I", [0])
+    total = 0
+    for text in texts:
+        total += len(text)
+        offsets.append(total)
+
+    flags = _FLAG_HAS_LANGUAGE if language is not None else 0
+    return b"".join([
+        _TRANSCRIPT_HEADER.pack(flags, len(segments), len(language_bytes)),
+        language_bytes,
+        _pack(array("d", (float(seg["start"]) for seg in segments))),
+        _pack(array("d", (float(seg["duration"]) for seg in segments))),
+        _pack(offsets),
+        b"".join(texts),
+    ])
+
+
+def _decode_transcript(body: bytes):
+    flags, count, language_length = _TRANSCRIPT_HEADER.unpack_from(body)
+    pos = _TRANSCRIPT_HEADER.size
+    language = body[pos:pos + language_length].decode("utf-8")
+    pos += language_length
+
+    starts = _unpack("d", body[pos:pos + 8 * count])
+    pos += 8 * count
+    durations = _unpack("d", body[pos:pos + 8 * count])
+    pos += 8 * count
+    offsets = _unpack("I", body[pos:pos + 4 * (count + 1)])
+    pos += 4 * (count + 1)
+    blob = body[pos:]
+
+    segments = [
+        {
+            "text": blob[offsets[i]:offsets[i + 1]].decode("utf-8"),
+            "start": starts[i],
+            "duration": durations[i],
+        }
+        for i in range(count)
+    ]
+    # Mirror what a JSON round trip of (segments, language) returns
+    if flags & _FLAG_HAS_LANGUAGE:
+        return [segments, language]
+    return segments
+
+
+class JsonCodec:
+    """The original format: plain JSON text. Kept for rollback and comparison."""
+
+    name = "json"
+
+    def encode_sized(self, value: Any) -> tuple[bytes, int]:
+        payload = json.dumps(value).encode("utf-8")
+        return payload, len(payload)
+
+
+class CompactCodec:
+    """Columnar transcripts and compressed JSON for everything else."""
+
+    name = "compact"
+
+    def __init__(self, compression: str = "zstd", level: int = 3):
+        if compression == "zstd" and zstandard is not None:
+            self.compression = COMPRESSION_ZSTD
+            self._compressor = zstandard.ZstdCompressor(level=level)
+        else:
+            self.compression = COMPRESSION_ZLIB
+            self._compressor = None
+        self.level = level
+
+    def _compress(self, body: bytes) -> bytes:
+        if self._compressor is not None:
+            return self._compressor.compress(body)
+        return zlib.compress(body, self.level)
+
+    def encode_sized(self, value: Any) -> tuple[bytes, int]:
+        if isinstance(value, (list, tuple)) and len(value) == 2 and _is_segment_list(value[0]) \
+                and isinstance(value[1], str):
+            version, body = VERSION_TRANSCRIPT, _encode_transcript(value[0], value[1])
+        elif _is_segment_list(value):
+            version, body = VERSION_TRANSCRIPT, _encode_transcript(value, None)
+        else:
+            version, body = VERSION_JSON, json.dumps(value, separators=(",", ":")).encode("utf-8")
+        return bytes([version, self.compression]) + self._compress(body), len(body)
+
+
+def _decompress(compression: int, data: bytes) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("Cache entry is zstd-compressed but 'zstandard' is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown cache compression: {compression}")
+
+
+def decode_sized(data: bytes | str) -> tuple[Any, int]:
+    """
+    Decodes any cache entry (compact or legacy JSON).
+    Returns the value and the size of its uncompressed body in bytes.
+    Raises ValueError for corrupted entries.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if not data:
+        raise ValueError("Empty cache entry")
+
+    version = data[0]
+    if version not in (VERSION_JSON, VERSION_TRANSCRIPT):
+        # Legacy entry written as plain JSON text
+        return json.loads(data), len(data)
+
+    try:
+        body = _decompress(data[1], data[2:])
+        if version == VERSION_JSON:
+            return json.loads(body), len(body)
+        return _decode_transcript(body), len(body)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Corrupted cache entry: {e}")
+
+
+def get_codec(name: str, compression: str = "zstd"):
+    """Returns the codec configured by name ('compact' or 'json')."""
+    if name == "json":
+        return JsonCodec()
+    return CompactCodec(compression=compression)
@@ -0,0 +1,254 @@
+"""
+Adaptive Concurrency Control.
+Building blocks for calling an upstream API that can be overloaded:
+
+- AdaptiveLimiter caps the number of calls in flight. The cap grows by about one
+  per window of successful, fast calls and shrinks multiplicatively when calls
+  are slow or the upstream reports overload (AIMD). Callers beyond the cap wait
+  in a bounded FIFO queue, each with its own deadline.
+- CircuitBreaker opens after consecutive failures and rejects calls outright
+  until a cooldown has passed; then a single probe call decides whether it closes.
+- FairScheduler runs a fixed number of expensive tasks at a time and orders the
+  waiting ones by weighted fair queuing across users, using each task's cost.
+
+All of them are per process and only used from the event loop, so no locking is needed.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a call is rejected without being attempted."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        latency_target: float,
+        backoff_ratio: float = 0.5,
+        slow_ratio: float = 0.9,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.slow_ratio = slow_ratio
+        self.inflight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    def _wake_waiters(self):
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot is handed over directly, so later arrivals can't jump the queue
+                self.inflight += 1
+                waiter.set_result(None)
+
+    async def acquire(self, timeout: float):
+        """
+        Takes a slot, waiting at most 'timeout' seconds in the queue.
+        Raises Overloaded if the queue is full or the deadline passes.
+        """
+        if self._has_capacity() and not self._waiters:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded("queue_full", retry_after=max(timeout, 1.0))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Got a slot just as the wait ended - give it back
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded("queue_timeout", retry_after=max(timeout, 1.0))
+            raise
+
+    def release(self):
+        self.inflight -= 1
+        self._wake_waiters()
+
+    def on_success(self, latency: float, started_at: float):
+        if latency > self.latency_target:
+            self._decrease(self.slow_ratio, started_at)
+        else:
+            # Additive increase: about +1 once a full window of calls has succeeded
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._wake_waiters()
+
+    def on_overload(self, started_at: float):
+        self._decrease(self.backoff_ratio, started_at)
+
+    def _decrease(self, ratio: float, started_at: float):
+        # Calls already in flight at the last decrease saw the old load; don't count them twice
+        if started_at < self._last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * ratio)
+        self._last_decrease = time.monotonic()
+
+    @asynccontextmanager
+    async def slot(self, timeout: float):
+        await self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_inflight = False
+
+    def before_call(self):
+        """Raises Overloaded if calls are currently not allowed."""
+        if self.state == self.CLOSED:
+            return
+        remaining = self._opened_at + self.cooldown_seconds - time.monotonic()
+        if self.state == self.OPEN and remaining > 0:
+            raise Overloaded("circuit_open", retry_after=remaining)
+        # Cooldown over: let exactly one probe call through
+        if self._probe_inflight:
+            raise Overloaded("circuit_open", retry_after=1.0)
+        self.state = self.HALF_OPEN
+        self._probe_inflight = True
+
+    def on_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_inflight = False
+
+    def on_failure(self):
+        self.failures += 1
+        self._probe_inflight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def on_ignored(self):
+        """The call ended without telling us anything about the upstream's health."""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+        self._probe_inflight = False
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing over users (self-clocked: the virtual time is the tag of
+    the last task started). Each task gets a finish tag = max(virtual time, the
+    user's last tag) + cost / weight, and free slots go to the waiting task with
+    the smallest tag, so cheap tasks go ahead of expensive ones. A user with a
+    backlog of expensive tasks pushes their own tags up, so other users' short
+    tasks overtake them; a user who was idle doesn't bank credit.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.running = 0
+        self.virtual_time = 0.0
+        self._last_finish: dict[str, float] = {}
+        self._queued_per_user: dict[str, int] = {}
+        self._heap: list[tuple[float, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return len(self._heap)
+
+    def _tag(self, user: str, cost: float, weight: float) -> float:
+        start = max(self.virtual_time, self._last_finish.get(user, 0.0))
+        finish = start + cost / weight
+        self._last_finish[user] = finish
+        return finish
+
+    def _dispatch(self):
+        while self._heap and self.running < self.slots:
+            tag, _, user, waiter = heapq.heappop(self._heap)
+            self._dequeued(user)
+            if waiter.done():
+                continue
+            self.virtual_time = max(self.virtual_time, tag)
+            self.running += 1
+            waiter.set_result(None)
+        # Users who are caught up with virtual time have nothing to remember
+        if len(self._last_finish) > 1000:
+            self._last_finish = {
+                user: finish for user, finish in self._last_finish.items()
+                if finish > self.virtual_time or user in self._queued_per_user
+            }
+
+    def _dequeued(self, user: str):
+        count = self._queued_per_user[user] - 1
+        if count:
+            self._queued_per_user[user] = count
+        else:
+            del self._queued_per_user[user]
+
+    async def acquire(self, user: str, cost: float, weight: float = 1.0):
+        tag = self._tag(user, max(cost, 0.0), weight)
+        if self.running < self.slots and not self._heap:
+            self.virtual_time = max(self.virtual_time, tag)
+            self.running += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._sequence), user, waiter))
+        self._queued_per_user[user] = self._queued_per_user.get(user, 0) + 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            # A cancelled waiter left in the heap is skipped by _dispatch
+            raise
+
+    def release(self):
+        self.running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str, cost: float, weight: float = 1.0):
+        await self.acquire(user, cost, weight)
+        try:
+            yield
+        finally:
+            self.release()
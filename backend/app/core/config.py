@@ -29,3 +29,165 @@ RATE_LIMIT_TRANSCRIPT_SECONDS = 60
 # Security configuration - defaults to localhost for development safety
 # In production, set CORS_ORIGINS env var to your allowed domains
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
+
+# Cache single-flight configuration
+# A worker that misses the cache takes a short Redis lease on the key so other
+# workers wait for its result instead of repeating the same upstream fetch.
+# The lease is renewed while the fetch runs, so the TTL only matters if the
+# worker dies; waiting workers give up with a 503 after CACHE_LOCK_WAIT_SECONDS.
+CACHE_LOCK_TTL_SECONDS = int(os.getenv("CACHE_LOCK_TTL_SECONDS", "180"))
+CACHE_LOCK_WAIT_SECONDS = float(os.getenv("CACHE_LOCK_WAIT_SECONDS", "180"))
+
+# In-process L1 cache in front of Redis (per worker)
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+L1_CACHE_TTL_SECONDS = int(os.getenv("L1_CACHE_TTL_SECONDS", "300"))
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Cache value encoding: "compact" (columnar + compressed) or "json" (legacy text)
+CACHE_CODEC = os.getenv("CACHE_CODEC", "compact")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd")  # falls back to zlib if zstandard is missing
+
+# Summary cache lifetimes: after the soft TTL a stale summary is still served
+# while one background refresh runs; the hard TTL is when it is finally dropped.
+SUMMARY_SOFT_TTL_SECONDS = int(os.getenv("SUMMARY_SOFT_TTL_SECONDS", "86400"))
+SUMMARY_HARD_TTL_SECONDS = int(os.getenv("SUMMARY_HARD_TTL_SECONDS", str(7 * 86400)))
+# Higher values refresh earlier (see XFetch); 0 disables early refresh
+CACHE_EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1.0"))
+
+# Summary pipeline stage timeouts (seconds)
+METADATA_STAGE_TIMEOUT_SECONDS = float(os.getenv("METADATA_STAGE_TIMEOUT_SECONDS", "10"))
+TRANSCRIPT_STAGE_TIMEOUT_SECONDS = float(os.getenv("TRANSCRIPT_STAGE_TIMEOUT_SECONDS", "45"))
+# How long a summary waits for the video description once the transcript is ready
+METADATA_GRACE_SECONDS = float(os.getenv("METADATA_GRACE_SECONDS", "1.0"))
+
+# Shared outgoing HTTP client (HTTP/2 is used only if the 'h2' package is installed)
+HTTP_CLIENT_HTTP2 = os.getenv("HTTP_CLIENT_HTTP2", "true").lower() == "true"
+HTTP_CLIENT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CLIENT_TIMEOUT_SECONDS", "10"))
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "100"))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", "20"))
+HTTP_CLIENT_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_CLIENT_KEEPALIVE_EXPIRY", "30"))
+
+# YouTube metadata changes rarely; cache it to save API quota
+METADATA_CACHE_TTL_SECONDS = int(os.getenv("METADATA_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+# Batch summarization
+BATCH_MAX_VIDEOS = 50
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+RATE_LIMIT_BATCH_TIMES = 2
+RATE_LIMIT_BATCH_SECONDS = 60
+
+# Background summarization jobs (Redis-backed queue)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # per process, 0 disables the workers
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "86400"))
+# A failed attempt is retried after JOB_RETRY_BASE_SECONDS, doubling per attempt
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "15"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+
+# Map-reduce summarization for transcripts over the single-prompt limit
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "40000"))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+
+# Chat context retrieval: only the most relevant transcript windows are sent
+CHAT_WINDOW_SECONDS = int(os.getenv("CHAT_WINDOW_SECONDS", "60"))
+CHAT_WINDOW_OVERLAP_SECONDS = int(os.getenv("CHAT_WINDOW_OVERLAP_SECONDS", "20"))
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", "8"))
+# Fraction of the question's terms the selected windows must contain, otherwise the full transcript is sent
+CHAT_MIN_TERM_COVERAGE = float(os.getenv("CHAT_MIN_TERM_COVERAGE", "0.5"))
+# Transcripts shorter than this are always sent in full
+CHAT_FULL_CONTEXT_CHARS = int(os.getenv("CHAT_FULL_CONTEXT_CHARS", "12000"))
+
+# Transcript compaction before prompting: caption fragments are merged into
+# windows of this many seconds with MM:SS stamps. If the result is over the
+# character budget (~4 chars per token), the windows are widened up to the max.
+TRANSCRIPT_COMPACT_WINDOW_SECONDS = int(os.getenv("TRANSCRIPT_COMPACT_WINDOW_SECONDS", "30"))
+TRANSCRIPT_COMPACT_MAX_WINDOW_SECONDS = int(os.getenv("TRANSCRIPT_COMPACT_MAX_WINDOW_SECONDS", "120"))
+TRANSCRIPT_PROMPT_CHAR_BUDGET = int(os.getenv("TRANSCRIPT_PROMPT_CHAR_BUDGET", "100000"))
+
+# yt-dlp audio downloads (fallback for videos without captions) run in their own
+# worker pool. Processes by default, since extraction is CPU-heavy; at most
+# WORKERS + QUEUE_SIZE downloads may be pending, further ones get a 503.
+AUDIO_DOWNLOAD_WORKERS = int(os.getenv("AUDIO_DOWNLOAD_WORKERS", "2"))
+AUDIO_DOWNLOAD_QUEUE_SIZE = int(os.getenv("AUDIO_DOWNLOAD_QUEUE_SIZE", "8"))
+AUDIO_DOWNLOAD_TIMEOUT_SECONDS = int(os.getenv("AUDIO_DOWNLOAD_TIMEOUT_SECONDS", "300"))
+AUDIO_DOWNLOAD_USE_PROCESSES = os.getenv("AUDIO_DOWNLOAD_USE_PROCESSES", "true").lower() == "true"
+AUDIO_DOWNLOAD_RETRY_AFTER_SECONDS = int(os.getenv("AUDIO_DOWNLOAD_RETRY_AFTER_SECONDS", "30"))
+
+# Downloaded audio is kept on disk and reused across languages and retries,
+# evicting the least recently used files beyond this many bytes. All app
+# processes (uvicorn workers) share the directory and its budget.
+AUDIO_STORE_DIR = os.getenv("AUDIO_STORE_DIR", "temp_audio")
+AUDIO_STORE_MAX_BYTES = int(os.getenv("AUDIO_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Gemini gateway: adaptive limit on concurrent Gemini calls (grows while calls
+# are fast, shrinks on slow calls and 429s), a bounded wait queue, and a circuit
+# breaker that rejects calls for a cooldown after consecutive failures. A call
+# (or a stream going quiet) longer than CALL_TIMEOUT counts as a failure.
+GEMINI_INITIAL_CONCURRENCY = int(os.getenv("GEMINI_INITIAL_CONCURRENCY", "8"))
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+GEMINI_QUEUE_SIZE = int(os.getenv("GEMINI_QUEUE_SIZE", "64"))
+GEMINI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("GEMINI_QUEUE_TIMEOUT_SECONDS", "20"))
+GEMINI_LATENCY_TARGET_SECONDS = float(os.getenv("GEMINI_LATENCY_TARGET_SECONDS", "30"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+GEMINI_CALL_TIMEOUT_SECONDS = float(os.getenv("GEMINI_CALL_TIMEOUT_SECONDS", "120"))
+
+# Summaries (transcript or audio) running at once per process. Waiting ones are
+# ordered by per-user weighted fair queuing on their estimated cost.
+SUMMARY_SCHEDULER_SLOTS = int(os.getenv("SUMMARY_SCHEDULER_SLOTS", "8"))
+
+# Retry budget shared by all retried operations: retries may add at most this
+# fraction of the first attempts, plus a small allowance per second.
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "0.5"))
+
+# Hedged transcript fetching: if the preferred extractor hasn't answered within
+# its observed p90 latency (the default delay until there are enough samples,
+# capped at the max), the next extractor is asked as well.
+TRANSCRIPT_HEDGE_ENABLED = os.getenv("TRANSCRIPT_HEDGE_ENABLED", "true").lower() == "true"
+TRANSCRIPT_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("TRANSCRIPT_HEDGE_DEFAULT_DELAY_SECONDS", "3"))
+TRANSCRIPT_HEDGE_MAX_DELAY_SECONDS = float(os.getenv("TRANSCRIPT_HEDGE_MAX_DELAY_SECONDS", "10"))
+# yt-dlp subtitle listings run in their own small thread pool; beyond workers +
+# queue size, yt-dlp transcript attempts fail fast.
+YTDLP_EXTRACT_WORKERS = int(os.getenv("YTDLP_EXTRACT_WORKERS", "2"))
+YTDLP_EXTRACT_QUEUE_SIZE = int(os.getenv("YTDLP_EXTRACT_QUEUE_SIZE", "8"))
+
+# Durable artifact store (MongoDB 'artifacts' collection) behind Redis for
+# transcripts and summaries, so they survive Redis expiry and eviction.
+ARTIFACT_STORE_ENABLED = os.getenv("ARTIFACT_STORE_ENABLED", "true").lower() == "true"
+ARTIFACT_STORE_TIMEOUT_SECONDS = float(os.getenv("ARTIFACT_STORE_TIMEOUT_SECONDS", "2"))
+
+# Password hashing runs in its own small thread pool. BCRYPT_ROUNDS is the cost
+# factor for new hashes; older hashes are upgraded on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_QUEUE_SIZE = int(os.getenv("AUTH_HASH_QUEUE_SIZE", "32"))
+
+# Authenticated requests refresh the user's record (profile, last_login) at most
+# once per window, in batched writes.
+USER_ACTIVITY_WINDOW_SECONDS = int(os.getenv("USER_ACTIVITY_WINDOW_SECONDS", "300"))
+USER_ACTIVITY_FLUSH_SECONDS = float(os.getenv("USER_ACTIVITY_FLUSH_SECONDS", "5"))
+USER_ACTIVITY_BATCH_SIZE = int(os.getenv("USER_ACTIVITY_BATCH_SIZE", "500"))
+
+# JWT verification. Verified tokens are cached in memory until they expire
+# (at most JWT_CACHE_MAX_TTL_SECONDS).
+JWT_SECRET = os.getenv("JWT_SECRET", "super_secret_key_change_me_in_prod")
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+JWT_CACHE_MAX_TTL_SECONDS = int(os.getenv("JWT_CACHE_MAX_TTL_SECONDS", "3600"))
+
+# History records are written behind the response, in batches of up to
+# HISTORY_WRITE_BATCH_SIZE every HISTORY_WRITE_FLUSH_SECONDS. Requests wait
+# once HISTORY_WRITE_BUFFER_SIZE records are waiting to be written.
+HISTORY_WRITE_FLUSH_SECONDS = float(os.getenv("HISTORY_WRITE_FLUSH_SECONDS", "0.5"))
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "100"))
+HISTORY_WRITE_BUFFER_SIZE = int(os.getenv("HISTORY_WRITE_BUFFER_SIZE", "1000"))
+# How long a request waits for room in a full buffer before its record is
+# dropped, and the limit for each bulk_write attempt.
+HISTORY_WRITE_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("HISTORY_WRITE_ENQUEUE_TIMEOUT_SECONDS", "1"))
+HISTORY_WRITE_TIMEOUT_SECONDS = float(os.getenv("HISTORY_WRITE_TIMEOUT_SECONDS", "5"))
+
+# Bearer token for the internal /metrics endpoint; the endpoint is disabled
+# (404) when it is not set.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
@@ -0,0 +1,62 @@
+"""
+Shared HTTP Client.
+One pooled httpx.AsyncClient for all outgoing API calls, created and closed
+with the app lifespan so connections (and their TLS sessions) are reused.
+"""
+import logging
+import httpx
+from app.core.config import (
+    HTTP_CLIENT_HTTP2,
+    HTTP_CLIENT_TIMEOUT_SECONDS,
+    HTTP_CLIENT_MAX_CONNECTIONS,
+    HTTP_CLIENT_MAX_KEEPALIVE,
+    HTTP_CLIENT_KEEPALIVE_EXPIRY,
+)
+
+try:
+    import h2  # noqa: F401 - only needed for HTTP/2 support
+    _H2_AVAILABLE = True
+except ImportError:
+    _H2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+http_client = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = HTTP_CLIENT_HTTP2 and _H2_AVAILABLE
+    if HTTP_CLIENT_HTTP2 and not _H2_AVAILABLE:
+        logger.info("HTTP/2 requested but 'h2' is not installed - using HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=HTTP_CLIENT_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_CLIENT_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def init_http_client():
+    """Creates the shared client on startup."""
+    global http_client
+    http_client = _build_client()
+    logger.info("Shared HTTP client initialized")
+
+
+async def close_http_client():
+    global http_client
+    if http_client:
+        await http_client.aclose()
+        http_client = None
+        logger.info("Shared HTTP client closed")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared client (created lazily when running outside the app lifespan)."""
+    global http_client
+    if http_client is None:
+        http_client = _build_client()
+    return http_client
@@ -0,0 +1,64 @@
+"""
+In-Process L1 Cache.
+A small, size-bounded LRU that sits in front of Redis so hot keys skip the
+network round trip and the JSON decode. Entries are keyed exactly like their
+Redis counterparts and never outlive the Redis TTL.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+
+class _Entry(NamedTuple):
+    value: Any
+    size: int
+    expires_at: float
+
+
+class MemoryLRUCache:
+    """
+    LRU cache bounded by the total (serialized) size of its values in bytes.
+    Values are shared between callers, so they must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int, max_ttl: float):
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry.expires_at <= time.time():
+            self.delete(key)
+            return default
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def set(self, key: str, value: Any, size: int, ttl: float):
+        """Stores a value; 'ttl' is the remaining lifetime of the Redis copy."""
+        ttl = min(ttl, self.max_ttl)
+        if size > self.max_bytes or ttl <= 0:
+            # Too big (or already expired) to be worth keeping in memory
+            self.delete(key)
+            return
+        self.delete(key)
+        self._entries[key] = _Entry(value, size, time.time() + ttl)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.size
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
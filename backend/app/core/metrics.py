@@ -0,0 +1,46 @@
+"""
+In-Process Metrics Module.
+Simple counters, gauges and value observations that the rest of the app
+records as it works, exposed as JSON through the /metrics endpoint.
+Everything is per worker process.
+"""
+from collections import defaultdict
+from typing import Callable
+
+_counters: defaultdict[str, int] = defaultdict(int)
+_gauges: dict[str, Callable[[], object]] = {}
+# name -> [count, total, max] of observed values (e.g. latencies, sizes)
+_observations: dict[str, list[float]] = {}
+
+
+def incr(name: str, amount: int = 1):
+    """Increments a named counter."""
+    _counters[name] += amount
+
+
+def observe(name: str, value: float):
+    """Records one observation of a value (count, sum and max are kept)."""
+    stats = _observations.get(name)
+    if stats is None:
+        _observations[name] = [1, value, value]
+    else:
+        stats[0] += 1
+        stats[1] += value
+        stats[2] = max(stats[2], value)
+
+
+def register_gauge(name: str, read: Callable[[], object]):
+    """Registers a callback that reports a current value (read at snapshot time)."""
+    _gauges[name] = read
+
+
+def snapshot() -> dict:
+    """Returns a copy of all metrics for reporting."""
+    return {
+        "counters": dict(sorted(_counters.items())),
+        "gauges": {name: read() for name, read in sorted(_gauges.items())},
+        "observations": {
+            name: {"count": count, "avg": total / count, "max": peak}
+            for name, (count, total, peak) in sorted(_observations.items())
+        },
+    }
@@ -0,0 +1,64 @@
+"""
+Password Hashing.
+bcrypt is deliberately slow (~100-300ms per hash), so it runs in a dedicated,
+bounded thread pool instead of on the event loop (bcrypt releases the GIL while
+hashing). When more than AUTH_HASH_WORKERS + AUTH_HASH_QUEUE_SIZE hashes are
+pending, new ones are rejected with a 503 rather than queueing without limit.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from fastapi import HTTPException
+from app.core import metrics
+from app.core.config import BCRYPT_ROUNDS, AUTH_HASH_WORKERS, AUTH_HASH_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_SECONDS = 2
+
+_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+metrics.register_gauge("auth.hash.pending", lambda: _pending)
+
+
+async def _run(function, *args):
+    global _pending
+    if _pending >= AUTH_HASH_WORKERS + AUTH_HASH_QUEUE_SIZE:
+        metrics.incr("auth.hash.rejected")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-in attempts in progress, please try again shortly",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+    finally:
+        _pending -= 1
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
+
+
+def _check(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _run(_check, password, password_hash)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """Whether a hash was made with a different cost factor than BCRYPT_ROUNDS."""
+    try:
+        # Format: $2b$<cost>$<salt+hash>
+        return int(password_hash.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
@@ -0,0 +1,131 @@
+"""
+Shared Retry Policy.
+One place that decides which failures are worth retrying and how often.
+
+- Errors are classified as transient (timeouts, connection errors, 429/5xx from
+  upstream APIs, retryable MongoDB errors, malformed model output) or permanent (everything else: bad API
+  key, blocked prompt, no transcript, ...). Only transient errors are retried.
+  Our own HTTPExceptions are classified by the error they were raised from.
+- Retries wait with jittered exponential backoff.
+- All retries in the process draw from one retry budget: every first attempt
+  adds RETRY_BUDGET_RATIO of a token and every retry spends a whole one, plus a
+  small per-second allowance for quiet periods. An outage therefore adds at most
+  about that fraction of extra calls instead of multiplying the load.
+"""
+import asyncio
+import json
+import time
+import httpx
+import requests
+from pymongo import errors as mongo_errors
+from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_base, stop_after_attempt, wait_random_exponential
+from app.core import metrics
+from app.core.config import RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND
+
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    TimeoutError,
+    ConnectionError,
+    httpx.TransportError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServerError,
+    # Also covers NotPrimaryError during a replica set election
+    mongo_errors.ConnectionFailure,
+    # The model returned something that isn't the JSON we asked for; another sample may be fine
+    json.JSONDecodeError,
+)
+
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether retrying the operation that raised 'exc' can succeed."""
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in TRANSIENT_STATUS_CODES
+    if isinstance(exc, mongo_errors.PyMongoError):
+        return exc.has_error_label("RetryableWriteError")
+    if isinstance(exc, HTTPException):
+        # Our own wrapper: judge the error it wraps. Without one it is a
+        # deliberate answer (e.g. a gateway rejection) and not retried.
+        cause = exc.__cause__
+        return cause is not None and is_transient(cause)
+    return False
+
+
+class RetryBudget:
+    """Token bucket that limits retries to a fraction of first attempts."""
+
+    def __init__(self, ratio: float, min_per_second: float, max_balance: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = min(max_balance, 10.0)
+        self._refilled_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    def record_request(self):
+        self._refill()
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND)
+metrics.register_gauge("retry.budget_balance", lambda: round(retry_budget.balance, 2))
+
+
+class _RetryIfTransient(retry_base):
+    def __init__(self, name: str, attempts: int):
+        self.name = name
+        self.attempts = attempts
+
+    def __call__(self, retry_state) -> bool:
+        if not retry_state.outcome.failed:
+            return False
+        exc = retry_state.outcome.exception()
+        if not is_transient(exc):
+            metrics.incr(f"retry.{self.name}.permanent")
+            return False
+        if retry_state.attempt_number >= self.attempts:
+            metrics.incr(f"retry.{self.name}.exhausted")
+            return False
+        if not retry_budget.try_spend():
+            metrics.incr(f"retry.{self.name}.over_budget")
+            return False
+        metrics.incr(f"retry.{self.name}.retried")
+        return True
+
+
+def _record_first_attempt(retry_state):
+    if retry_state.attempt_number == 1:
+        retry_budget.record_request()
+
+
+def retry_policy(name: str, attempts: int = 4, min_wait: float = 1, max_wait: float = 15):
+    """
+    Tenacity decorator for an async operation: up to 'attempts' tries, retrying
+    transient errors only, with jittered backoff, within the global retry budget.
+    The last error is re-raised as is.
+    """
+    return retry(
+        stop=stop_after_attempt(attempts),
+        wait=wait_random_exponential(multiplier=1, min=min_wait, max=max_wait),
+        retry=_RetryIfTransient(name, attempts),
+        before=_record_first_attempt,
+        reraise=True,
+    )
@@ -0,0 +1,115 @@
+"""
+Durable Artifact Store.
+Keeps expensive, effectively immutable cache values (transcripts, summaries) in
+MongoDB so they outlive their Redis TTL. Values are stored exactly as the cache
+codec encodes them (compressed bytes), keyed by their cache key.
+
+Documents: {_id: cache_key, data: bytes, size, created_at, last_accessed}.
+'last_accessed' is bumped when an artifact is read, and (at most once per
+TOUCH_INTERVAL_SECONDS per process) when its value is served from Redis or the
+L1, so old, unused artifacts can be pruned offline, e.g.
+deleteMany({last_accessed: {$lt: cutoff}}) with a cutoff well beyond the interval.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from bson import Binary
+from app.core.config import ARTIFACT_STORE_ENABLED, ARTIFACT_STORE_TIMEOUT_SECONDS
+from app.db.database import artifacts_collection
+
+logger = logging.getLogger(__name__)
+
+TOUCH_INTERVAL_SECONDS = 6 * 3600
+# Forget keys whose interval has passed once this many are remembered
+MAX_TOUCHED_KEYS = 10000
+
+_touched: dict[str, float] = {}
+_touch_tasks: set[asyncio.Task] = set()
+
+
+def artifacts_available() -> bool:
+    return ARTIFACT_STORE_ENABLED and artifacts_collection is not None
+
+
+async def load_artifact(cache_key: str) -> bytes | None:
+    """Returns the stored bytes for a key (and marks them as used), or None."""
+    if not artifacts_available():
+        return None
+    try:
+        doc = await asyncio.wait_for(
+            artifacts_collection.find_one_and_update(
+                {"_id": cache_key},
+                {"$set": {"last_accessed": datetime.now(timezone.utc)}},
+                projection={"data": 1},
+            ),
+            ARTIFACT_STORE_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        logger.warning(f"Artifact store read failed for {cache_key}: {e}")
+        return None
+    return bytes(doc["data"]) if doc else None
+
+
+def touch_artifact(cache_key: str):
+    """
+    Notes that a key's value was served from a faster tier, so pruning doesn't
+    take the hottest artifacts for unused ones. Never blocks; throttled per key.
+    """
+    if not artifacts_available():
+        return
+    global _touched
+    now = time.monotonic()
+    touched_at = _touched.get(cache_key)
+    if touched_at is not None and now - touched_at < TOUCH_INTERVAL_SECONDS:
+        return
+    if len(_touched) >= MAX_TOUCHED_KEYS:
+        _touched = {key: at for key, at in _touched.items() if now - at < TOUCH_INTERVAL_SECONDS}
+    _touched[cache_key] = now
+    task = asyncio.create_task(_touch(cache_key))
+    _touch_tasks.add(task)
+    task.add_done_callback(_touch_tasks.discard)
+
+
+async def _touch(cache_key: str):
+    try:
+        await asyncio.wait_for(
+            artifacts_collection.update_one(
+                {"_id": cache_key}, {"$set": {"last_accessed": datetime.now(timezone.utc)}}
+            ),
+            ARTIFACT_STORE_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        logger.warning(f"Artifact store touch failed for {cache_key}: {e}")
+
+
+async def save_artifact(cache_key: str, data: bytes, size: int):
+    if not artifacts_available():
+        return
+    now = datetime.now(timezone.utc)
+    try:
+        await asyncio.wait_for(
+            artifacts_collection.update_one(
+                {"_id": cache_key},
+                {
+                    "$set": {"data": Binary(data), "size": size, "last_accessed": now},
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+            ),
+            ARTIFACT_STORE_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        logger.warning(f"Artifact store write failed for {cache_key}: {e}")
+
+
+async def delete_artifacts(cache_keys: list[str]):
+    if not artifacts_available() or not cache_keys:
+        return
+    try:
+        await asyncio.wait_for(
+            artifacts_collection.delete_many({"_id": {"$in": cache_keys}}),
+            ARTIFACT_STORE_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        logger.warning(f"Artifact store delete failed for {cache_keys}: {e}")
@@ -1,18 +1,22 @@
 from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from app.db.database import history_collection, users_collection
-import bcrypt
+from app.core import passwords
 import uuid
 
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
-async def create_history_record(user_id: str, video_id: str, title: str, thumbnail: str, language: str, full_data: Optional[Dict[str, Any]] = None):
+# Fields the history list needs; the summary itself is loaded per record
+HISTORY_LIST_PROJECTION = {"video_id": 1, "title": 1, "thumbnail": 1, "language": 1, "created_at": 1}
+
+# A user has one history record per video and summary language
+HISTORY_RECORD_KEY = ("user_id", "video_id", "language")
+
+def build_history_record(user_id: str, video_id: str, title: str, thumbnail: str, language: str, full_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Creates or updates a history record in MongoDB.
-    Associates the record with a specific user_id.
+    Builds the history document for a summary (upserted on HISTORY_RECORD_KEY).
     """
-    if history_collection is None:
-        return None
-        
     doc = {
         "user_id": user_id,
         "video_id": video_id,
@@ -29,23 +33,30 @@ async def create_history_record(user_id: str, video_id: str, title: str, thumbna
         if "full_transcript" in data_to_store:
             del data_to_store["full_transcript"]
         doc["summary_data"] = data_to_store
-
-    # Upsert based on user_id, video_id, and language
-    await history_collection.update_one(
-        {"user_id": user_id, "video_id": video_id, "language": language},
-        {"$set": doc},
-        upsert=True
-    )
     return doc
 
-async def get_recent_history(user_id: str, limit: int = 20):
+async def get_recent_history(user_id: str, limit: int = 20, before: Optional[Tuple[datetime, ObjectId]] = None):
     """
-    Fetches the most recently summarized videos for a specific user.
+    Fetches the most recently summarized videos for a specific user (without the summaries).
+    'before' is a (created_at, _id) keyset cursor: only older records are returned.
     """
     if history_collection is None:
         return []
-        
-    cursor = history_collection.find({"user_id": user_id}).sort("created_at", -1).limit(limit)
+
+    query: Dict[str, Any] = {"user_id": user_id}
+    if before:
+        created_at, record_id = before
+        # The range bound lets the index scan start at the cursor; $or breaks created_at ties
+        query["created_at"] = {"$lte": created_at}
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": record_id}},
+        ]
+    cursor = (
+        history_collection.find(query, HISTORY_LIST_PROJECTION)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit)
+    )
     records = await cursor.to_list(length=limit)
     
     # MongoDB returns _id as ObjectId which is not JSON serializable directly by FastAPI unless handled
@@ -55,32 +66,21 @@ async def get_recent_history(user_id: str, limit: int = 20):
         
     return records
 
-async def upsert_user(user_id: str, name: Optional[str] = None, email: Optional[str] = None, picture: Optional[str] = None):
+async def get_history_record(user_id: str, video_id: str, language: Optional[str] = None):
     """
-    Creates or updates a user record in MongoDB based on JWT info.
+    Fetches one history record with its full summary data
+    (the most recent one for the video if no language is given).
     """
-    if users_collection is None:
+    if history_collection is None:
         return None
-        
-    update_data: Dict[str, Any] = {
-        "last_login": datetime.now(timezone.utc)
-    }
-    
-    if name:
-        update_data["name"] = name
-    if email:
-        update_data["email"] = email
-    if picture:
-        update_data["picture"] = picture
-        
-    await users_collection.update_one(
-        {"_id": user_id},
-        {
-            "$set": update_data,
-            "$setOnInsert": {"created_at": datetime.now(timezone.utc)}
-        },
-        upsert=True
-    )
+
+    query: Dict[str, Any] = {"user_id": user_id, "video_id": video_id}
+    if language:
+        query["language"] = language
+    record = await history_collection.find_one(query, sort=[("created_at", -1), ("_id", -1)])
+    if record:
+        record["_id"] = str(record["_id"])
+    return record
 
 async def register_user(email: str, password: str, name: Optional[str] = None):
     """
@@ -94,7 +94,7 @@ async def register_user(email: str, password: str, name: Optional[str] = None):
     if existing_user:
         return None  # Email already exists
         
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = await passwords.hash_password(password)
     user_id = str(uuid.uuid4())
     
     new_user = {
@@ -107,7 +107,11 @@ async def register_user(email: str, password: str, name: Optional[str] = None):
         "last_login": datetime.now(timezone.utc)
     }
     
-    await users_collection.insert_one(new_user)
+    try:
+        await users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        # A concurrent registration for the same email got there first
+        return None
     return new_user
 
 async def verify_user(email: str, password: str):
@@ -122,11 +126,15 @@ async def verify_user(email: str, password: str):
     if not user:
         return None
         
-    if bcrypt.checkpw(password.encode('utf-8'), user["password_hash"].encode('utf-8')):
+    if await passwords.verify_password(password, user["password_hash"]):
         # Update last login
+        update: Dict[str, Any] = {"last_login": datetime.now(timezone.utc)}
+        # Upgrade the hash if the configured cost factor changed since it was made
+        if passwords.needs_rehash(user["password_hash"]):
+            update["password_hash"] = await passwords.hash_password(password)
         await users_collection.update_one(
             {"_id": user["_id"]},
-            {"$set": {"last_login": datetime.now(timezone.utc)}}
+            {"$set": update}
         )
         return user
         
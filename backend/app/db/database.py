@@ -1,7 +1,10 @@
+import asyncio
 import os
 import logging
 from typing import Optional, Any
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
@@ -13,18 +16,86 @@ client: Optional[AsyncIOMotorClient[Any]] = None
 db: Optional[AsyncIOMotorDatabase[Any]] = None
 history_collection: Optional[AsyncIOMotorCollection[Any]] = None
 users_collection: Optional[AsyncIOMotorCollection[Any]] = None
+artifacts_collection: Optional[AsyncIOMotorCollection[Any]] = None
 
 try:
     client = AsyncIOMotorClient(MONGO_URI)
     db = client["vidscribe"]
     history_collection = db["history"]
     users_collection = db["users"]
+    artifacts_collection = db["artifacts"]
     logger.info("Connected to MongoDB successfully")
 except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     db = None
     history_collection = None
     users_collection = None
+    artifacts_collection = None
 
 async def get_db() -> Optional[AsyncIOMotorDatabase[Any]]:
     return db
+
+
+# Indexes matching our query shapes, created at startup (a no-op when they exist)
+_INDEXES = {
+    "history": [
+        # Recent history list: filter on user, newest first, _id breaks ties for paging
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_recent"),
+        # Upsert key of history records (see crud.HISTORY_RECORD_KEY)
+        IndexModel(
+            [("user_id", ASCENDING), ("video_id", ASCENDING), ("language", ASCENDING)],
+            name="user_video_language",
+            unique=True,
+        ),
+    ],
+    "users": [
+        # One local (email + password) account per email. Provider accounts are
+        # keyed by their provider id and may share an email with a local one.
+        IndexModel(
+            [("email", ASCENDING)],
+            name="local_email_unique",
+            unique=True,
+            partialFilterExpression={"auth_provider": "local", "email": {"$type": "string"}},
+        ),
+    ],
+    "artifacts": [
+        # For pruning artifacts nobody has read in a while
+        IndexModel([("last_accessed", ASCENDING)], name="last_accessed"),
+    ],
+}
+
+
+# Indexes we used to create and have replaced
+_OBSOLETE_INDEXES = {
+    # Also covered provider accounts, which can legitimately share an email
+    "users": ["email_unique"],
+}
+
+# MongoDB's IndexNotFound error code
+_INDEX_NOT_FOUND = 27
+
+
+async def ensure_indexes(timeout: float = 10.0):
+    """Creates the collection indexes (dropping replaced ones); failures are logged, not fatal."""
+    if db is None:
+        return
+    for collection_name, names in _OBSOLETE_INDEXES.items():
+        for name in names:
+            try:
+                await asyncio.wait_for(db[collection_name].drop_index(name), timeout)
+                logger.info(f"Dropped obsolete index '{name}' on '{collection_name}'")
+            except OperationFailure as e:
+                if e.code != _INDEX_NOT_FOUND:
+                    logger.error(f"Failed to drop index '{name}' on '{collection_name}': {e}")
+            except Exception as e:
+                logger.error(f"Failed to drop index '{name}' on '{collection_name}': {e}")
+    for collection_name, indexes in _INDEXES.items():
+        try:
+            await asyncio.wait_for(db[collection_name].create_indexes(indexes), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Timed out creating MongoDB indexes - is MongoDB reachable?")
+            return
+        except Exception as e:
+            # e.g. duplicates already in the data prevent a unique index
+            logger.error(f"Failed to create indexes on '{collection_name}': {e}")
+    logger.info("MongoDB indexes ensured")
@@ -0,0 +1,138 @@
+"""
+History Writer.
+Writes history records behind the response instead of on the request path.
+
+Records are buffered (the latest one wins for the same user, video and
+language) and upserted with bulk_write every HISTORY_WRITE_FLUSH_SECONDS, or
+sooner once HISTORY_WRITE_BATCH_SIZE are waiting. Transient MongoDB errors are
+retried with the shared retry policy (each attempt limited to
+HISTORY_WRITE_TIMEOUT_SECONDS); a batch that still fails is logged and dropped.
+When HISTORY_WRITE_BUFFER_SIZE records are waiting (MongoDB can't keep up),
+callers wait up to HISTORY_WRITE_ENQUEUE_TIMEOUT_SECONDS for the next flush,
+after which their record is dropped, so a MongoDB outage doesn't hold up requests.
+
+A new record shows up in /history after the next flush, usually well under a second.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+from pymongo import UpdateOne
+from app.core import metrics
+from app.core.config import (
+    HISTORY_WRITE_FLUSH_SECONDS,
+    HISTORY_WRITE_BATCH_SIZE,
+    HISTORY_WRITE_BUFFER_SIZE,
+    HISTORY_WRITE_ENQUEUE_TIMEOUT_SECONDS,
+    HISTORY_WRITE_TIMEOUT_SECONDS,
+)
+from app.core.retry import retry_policy
+from app.db.crud import HISTORY_RECORD_KEY
+from app.db.database import history_collection
+
+logger = logging.getLogger(__name__)
+
+_buffer: Dict[Tuple, Dict[str, Any]] = {}
+_flush_requested = asyncio.Event()
+_space_available = asyncio.Condition()
+_flusher_task: Optional[asyncio.Task] = None
+_stopping = False
+
+metrics.register_gauge("history_writer.buffered", lambda: len(_buffer))
+
+
+async def enqueue(record: Dict[str, Any]):
+    """
+    Queues a history record (see crud.build_history_record) for writing.
+    Returns right away unless the buffer is full; then waits a bounded time
+    for room and drops the record if none frees up. Without a running writer
+    (e.g. outside the app), the record is written immediately.
+    """
+    if history_collection is None:
+        return
+    if _flusher_task is None:
+        await _write([record])
+        return
+
+    key = tuple(record[field] for field in HISTORY_RECORD_KEY)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + HISTORY_WRITE_ENQUEUE_TIMEOUT_SECONDS
+    while key not in _buffer and len(_buffer) >= HISTORY_WRITE_BUFFER_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            metrics.incr("history_writer.shed")
+            logger.warning(f"History buffer full, dropping record for video {record['video_id']}")
+            return
+        metrics.incr("history_writer.backpressure")
+        _flush_requested.set()
+        async with _space_available:
+            try:
+                await asyncio.wait_for(_space_available.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    _buffer[key] = record
+    if len(_buffer) >= HISTORY_WRITE_BATCH_SIZE:
+        _flush_requested.set()
+
+
+@retry_policy("history_write", attempts=4, min_wait=0.5, max_wait=5)
+async def _bulk_write(operations: list):
+    # Upserts with $set are idempotent, so retrying a partly applied batch is safe.
+    # The timeout keeps one attempt from waiting out the driver's server selection.
+    await asyncio.wait_for(history_collection.bulk_write(operations, ordered=False), HISTORY_WRITE_TIMEOUT_SECONDS)
+
+
+async def _write(records: list):
+    for start in range(0, len(records), HISTORY_WRITE_BATCH_SIZE):
+        batch = records[start:start + HISTORY_WRITE_BATCH_SIZE]
+        operations = [
+            UpdateOne(
+                {field: record[field] for field in HISTORY_RECORD_KEY},
+                {"$set": record},
+                upsert=True,
+            )
+            for record in batch
+        ]
+        try:
+            await _bulk_write(operations)
+            metrics.incr("history_writer.written", len(operations))
+        except Exception as e:
+            metrics.incr("history_writer.dropped", len(operations))
+            logger.error(f"Failed to write {len(operations)} history records: {e}")
+
+
+async def flush():
+    """Writes everything buffered so far."""
+    global _buffer
+    if not _buffer:
+        return
+    records, _buffer = list(_buffer.values()), {}
+    async with _space_available:
+        _space_available.notify_all()
+    await _write(records)
+
+
+async def _flush_loop():
+    while not _stopping:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), HISTORY_WRITE_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        await flush()
+
+
+def start_writer():
+    global _flusher_task, _stopping
+    _stopping = False
+    _flusher_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_writer():
+    """Stops the periodic flush (letting a running one finish) and writes whatever is still buffered."""
+    global _flusher_task, _stopping
+    if _flusher_task:
+        _stopping = True
+        _flush_requested.set()
+        await _flusher_task
+        _flusher_task = None
+    await flush()
@@ -0,0 +1,143 @@
+"""
+User Activity Writer.
+Keeps the users collection in sync with the JWTs we see (profile fields and
+'last_login') without a MongoDB write on every authenticated request.
+
+- A user seen within the last USER_ACTIVITY_WINDOW_SECONDS is skipped outright
+  (tracked in memory; across workers a Redis 'user_seen:{id}' key decides who writes).
+- Updates are coalesced per user and written every USER_ACTIVITY_FLUSH_SECONDS,
+  or as soon as USER_ACTIVITY_BATCH_SIZE users are pending, as one bulk_write.
+
+Activity is best effort: a failed flush is logged and dropped, and profile
+changes in the token show up once the user's window has passed.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from pymongo import UpdateOne
+from app.core import cache, metrics
+from app.core.config import (
+    USER_ACTIVITY_WINDOW_SECONDS,
+    USER_ACTIVITY_FLUSH_SECONDS,
+    USER_ACTIVITY_BATCH_SIZE,
+)
+from app.db.database import users_collection
+
+logger = logging.getLogger(__name__)
+
+# Forget users whose window has passed once this many are remembered
+MAX_RECENT_USERS = 10000
+
+_pending: Dict[str, Dict[str, Any]] = {}
+_recent: Dict[str, float] = {}
+_flush_requested = asyncio.Event()
+_flusher_task: Optional[asyncio.Task] = None
+_stopping = False
+
+metrics.register_gauge("user_activity.pending", lambda: len(_pending))
+
+
+def record_activity(user_id: str, name: Optional[str] = None, email: Optional[str] = None, picture: Optional[str] = None):
+    """Notes that a user made an authenticated request. Never blocks."""
+    now = time.monotonic()
+    seen_at = _recent.get(user_id)
+    if seen_at is not None and now - seen_at < USER_ACTIVITY_WINDOW_SECONDS:
+        metrics.incr("user_activity.skipped")
+        return
+    _remember(user_id, now)
+
+    update = _pending.setdefault(user_id, {})
+    update["last_login"] = datetime.now(timezone.utc)
+    if name:
+        update["name"] = name
+    if email:
+        update["email"] = email
+    if picture:
+        update["picture"] = picture
+    if len(_pending) >= USER_ACTIVITY_BATCH_SIZE:
+        _flush_requested.set()
+
+
+def _remember(user_id: str, now: float):
+    global _recent
+    if len(_recent) >= MAX_RECENT_USERS:
+        _recent = {
+            user: seen_at for user, seen_at in _recent.items()
+            if now - seen_at < USER_ACTIVITY_WINDOW_SECONDS
+        }
+    _recent[user_id] = now
+
+
+async def _claim(user_ids: list[str]) -> list[str]:
+    """Keeps only the users no other worker has written within the window."""
+    redis_client = cache.redis_client
+    if not redis_client:
+        return user_ids
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.set(f"user_seen:{user_id}", 1, nx=True, ex=USER_ACTIVITY_WINDOW_SECONDS)
+            claimed = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"User activity claim failed, writing all pending users: {e}")
+        return user_ids
+    return [user_id for user_id, ok in zip(user_ids, claimed) if ok]
+
+
+async def flush():
+    """Writes all pending updates in one bulk_write."""
+    global _pending
+    if not _pending:
+        return
+    batch, _pending = _pending, {}
+    if users_collection is None:
+        return
+
+    user_ids = await _claim(list(batch))
+    metrics.incr("user_activity.skipped", len(batch) - len(user_ids))
+    if not user_ids:
+        return
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {"_id": user_id},
+            {"$set": batch[user_id], "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        )
+        for user_id in user_ids
+    ]
+    try:
+        await users_collection.bulk_write(operations, ordered=False)
+        metrics.incr("user_activity.written", len(operations))
+    except Exception as e:
+        metrics.incr("user_activity.failed", len(operations))
+        logger.error(f"Failed to write activity for {len(operations)} users: {e}")
+
+
+async def _flush_loop():
+    while not _stopping:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), USER_ACTIVITY_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        await flush()
+
+
+def start_writer():
+    global _flusher_task, _stopping
+    _stopping = False
+    _flusher_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_writer():
+    """Stops the periodic flush (letting a running one finish) and writes whatever is still pending."""
+    global _flusher_task, _stopping
+    if _flusher_task:
+        _stopping = True
+        _flush_requested.set()
+        await _flusher_task
+        _flusher_task = None
+    await flush()
@@ -13,8 +13,10 @@ from fastapi.responses import JSONResponse
 import logging
 
 from fastapi_limiter import FastAPILimiter
-from app.core import cache
+from app.core import cache, http_client
+from app.db import database, user_activity, history_writer
 from app.api import api
+from app.services import audio, jobs
 from app.core.config import CORS_ORIGINS
 from app.core.exception_handlers import rate_limit_exceeded_handler
 
@@ -33,8 +35,13 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """
     Handles startup and shutdown logic.
-    On startup: Verifies environment variables and connects to Redis.
-    On shutdown: Closes the Redis connection safely.
+    On startup: Verifies environment variables, connects to Redis, ensures the
+    MongoDB indexes exist, opens the shared HTTP client, starts the audio
+    download pool, the background job workers and the user activity and
+    history writers.
+    On shutdown: Stops the job workers, flushes pending user activity and
+    history records, stops the download pool, closes the HTTP client and the
+    Redis connection safely.
     """
     # Security check: verify required environment variables
     required_env_vars = ["GEMINI_API_KEY", "YOUTUBE_API_KEY", "REDIS_URL"]
@@ -45,12 +52,23 @@ async def lifespan(app: FastAPI):
         # We don't exit to allow the app to show error states, but functionality will be limited
         
     await cache.init_redis()
+    await database.ensure_indexes()
+    await http_client.init_http_client()
     if cache.redis_client:
         await FastAPILimiter.init(cache.redis_client)
         logger.info("Rate limiter initialized")
     else:
         logger.warning("Rate limiter NOT initialized - Redis client is missing")
+    audio.start_download_pool()
+    jobs.start_workers()
+    user_activity.start_writer()
+    history_writer.start_writer()
     yield
+    await jobs.stop_workers()
+    await user_activity.stop_writer()
+    await history_writer.stop_writer()
+    await audio.shutdown_download_pool()
+    await http_client.close_http_client()
     await cache.close_redis()
 
 
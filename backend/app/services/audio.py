@@ -1,46 +1,211 @@
-import os
+"""
+Audio Download Service.
+Downloads video audio with yt-dlp for the fallback path (videos without captions).
+Finished downloads go into the on-disk audio store, so each video is downloaded
+once and shared by every target language, retry and app process.
+
+Downloads run in a dedicated worker pool (processes by default) rather than the
+default thread executor, so a burst of caption-less videos can't starve the
+transcript fetches. The pool has a bounded backlog: once it is full, new
+downloads are rejected with a 503 and a Retry-After header. Concurrent requests
+for the same video share one download.
+"""
+import asyncio
+import hashlib
+import multiprocessing
 import yt_dlp
 import uuid
 import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from fastapi import HTTPException
+from app.core import metrics
+from app.core.config import (
+    AUDIO_STORE_DIR,
+    AUDIO_STORE_MAX_BYTES,
+    AUDIO_DOWNLOAD_WORKERS,
+    AUDIO_DOWNLOAD_QUEUE_SIZE,
+    AUDIO_DOWNLOAD_TIMEOUT_SECONDS,
+    AUDIO_DOWNLOAD_USE_PROCESSES,
+    AUDIO_DOWNLOAD_RETRY_AFTER_SECONDS,
+)
+from app.services.audio_store import AudioStore
 
 logger = logging.getLogger(__name__)
 
-TEMP_DIR = Path("temp_audio")
-TEMP_DIR.mkdir(exist_ok=True)
+AUDIO_FORMAT = "m4a/bestaudio/best"
+# Stored files are keyed by video id and format, so changing the format doesn't reuse old files
+FORMAT_TAG = hashlib.sha256(AUDIO_FORMAT.encode()).hexdigest()[:8]
+
+_executor: Executor | None = None
+# Created in the app process only - the download worker processes import this module too
+audio_store: AudioStore | None = None
+# Downloads that are queued or running in this process, by video id
+_inflight: dict[str, asyncio.Task] = {}
+# Held until a worker has really finished a download (even one we stopped waiting
+# for), so queued downloads wait here rather than in the executor's unbounded
+# queue, and the timeout only starts once a worker is free
+_slots = asyncio.Semaphore(AUDIO_DOWNLOAD_WORKERS)
 
-def download_audio(video_id: str) -> str | None:
+metrics.register_gauge("audio.downloads.inflight", lambda: len(_inflight))
+metrics.register_gauge("audio.store.files", lambda: len(audio_store) if audio_store else 0)
+metrics.register_gauge("audio.store.bytes", lambda: audio_store.current_bytes if audio_store else 0)
+
+def download_audio(video_id: str, directory: str) -> str | None:
     """
-    Downloads the audio of a YouTube video using yt-dlp.
+    Downloads the audio of a YouTube video into 'directory' using yt-dlp.
     Returns the path to the downloaded audio file or None if it fails.
+    Runs in a download worker, so it must not touch the audio store.
     """
     url = f"https://www.youtube.com/watch?v={video_id}"
-    output_filename = TEMP_DIR / f"{video_id}_{uuid.uuid4().hex[:8]}.%(ext)s"
+    output_filename = Path(directory) / f"{video_id}_{uuid.uuid4().hex[:8]}.%(ext)s"
     
     ydl_opts = {
-        'format': 'm4a/bestaudio/best',
+        'format': AUDIO_FORMAT,
         'outtmpl': str(output_filename),
         'quiet': True,
-        'no_warnings': True
+        'no_warnings': True,
+        'socket_timeout': 30,
     }
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:  # type: ignore
-            ydl.extract_info(url, download=True)
-            # Find whatever file was downloaded since the extension could be .m4a or .webm
-            for f in TEMP_DIR.glob(f"{video_id}_*"):
-                return str(f)
-                
+            info = ydl.extract_info(url, download=True)
+            # The extension depends on the format picked (.m4a, .webm, ...)
+            downloads = info.get("requested_downloads") or []
+            if downloads and downloads[0].get("filepath"):
+                return downloads[0]["filepath"]
+            return ydl.prepare_filename(info)
+
     except Exception as e:
         logger.error(f"Failed to download audio for {video_id}: {e}")
         return None
-    
-    return None
 
-def cleanup_audio(filepath: str):
-    """Deletes the temporary audio file."""
+
+def _get_store() -> AudioStore:
+    global audio_store
+    if audio_store is None:
+        audio_store = AudioStore(Path(AUDIO_STORE_DIR), AUDIO_STORE_MAX_BYTES)
+    return audio_store
+
+
+def _store_key(video_id: str) -> str:
+    return AudioStore.key(video_id, FORMAT_TAG)
+
+
+def start_download_pool():
+    """Opens the audio store and creates the download worker pool."""
+    global _executor
+    _get_store()
+    if _executor is not None:
+        return
+    if AUDIO_DOWNLOAD_USE_PROCESSES:
+        # 'spawn' - forking a process that runs an event loop and threads isn't safe
+        _executor = ProcessPoolExecutor(
+            max_workers=AUDIO_DOWNLOAD_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    else:
+        _executor = ThreadPoolExecutor(max_workers=AUDIO_DOWNLOAD_WORKERS, thread_name_prefix="audio-dl")
+    logger.info(f"Audio download pool started with {AUDIO_DOWNLOAD_WORKERS} worker(s)")
+
+
+async def shutdown_download_pool():
+    """Cancels queued downloads and shuts the pool down."""
+    global _executor
+    for task in list(_inflight.values()):
+        task.cancel()
+    await asyncio.gather(*_inflight.values(), return_exceptions=True)
+    _inflight.clear()
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+def _store_late_download(video_id: str, future: asyncio.Future):
+    """Keeps a download that finished after we stopped waiting for it."""
+    if future.cancelled() or future.exception() is not None or not future.result():
+        return
     try:
-        if filepath and os.path.exists(filepath):
-            os.remove(filepath)
+        _get_store().add(_store_key(video_id), future.result())
+        logger.info(f"Stored audio for {video_id} that finished after its timeout")
     except Exception as e:
-        logger.error(f"Failed to cleanup {filepath}: {e}")
+        logger.error(f"Failed to store late audio download for {video_id}: {e}")
+
+
+async def _run_download(video_id: str) -> str | None:
+    if _executor is None:
+        start_download_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        await _slots.acquire()
+        try:
+            future = loop.run_in_executor(
+                _executor, download_audio, video_id, str(_get_store().staging_directory)
+            )
+        except Exception:
+            _slots.release()
+            raise
+        future.add_done_callback(lambda _: _slots.release())
+        try:
+            # Shielded: the worker keeps running after a timeout, and so does the future
+            path = await asyncio.wait_for(asyncio.shield(future), AUDIO_DOWNLOAD_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            future.add_done_callback(lambda f: _store_late_download(video_id, f))
+            raise
+        if not path:
+            return None
+        return _get_store().add(_store_key(video_id), path)
+    except asyncio.TimeoutError:
+        # The worker can't be interrupted; yt-dlp's socket timeout ends a stalled download.
+        # Its slot stays taken until it does finish.
+        logger.error(f"Audio download for {video_id} timed out after {AUDIO_DOWNLOAD_TIMEOUT_SECONDS}s")
+        metrics.incr("audio.download.timeout")
+        return None
+    except Exception as e:
+        # e.g. a worker process died and broke the pool
+        logger.error(f"Audio download worker failed for {video_id}: {e}")
+        return None
+    finally:
+        _inflight.pop(video_id, None)
+
+
+async def schedule_download(video_id: str) -> str | None:
+    """
+    Downloads a video's audio in the worker pool and adds it to the audio store.
+    Returns the stored file path, or None if the download failed or timed out.
+    Raises a 503 HTTPException when the download backlog is full.
+    """
+    task = _inflight.get(video_id)
+    if task is None:
+        if len(_inflight) >= AUDIO_DOWNLOAD_WORKERS + AUDIO_DOWNLOAD_QUEUE_SIZE:
+            metrics.incr("audio.download.rejected")
+            raise HTTPException(
+                status_code=503,
+                detail="Too many audio downloads in progress, please try again shortly",
+                headers={"Retry-After": str(AUDIO_DOWNLOAD_RETRY_AFTER_SECONDS)},
+            )
+        task = asyncio.create_task(_run_download(video_id))
+        _inflight[video_id] = task
+    # Shielded so one caller going away doesn't cancel the download for the others
+    return await asyncio.shield(task)
+
+
+async def acquire_audio(video_id: str) -> str | None:
+    """
+    Returns the path of a video's audio, downloading it if it isn't stored yet,
+    or None if it can't be downloaded. The file is kept until release_audio().
+    """
+    store = _get_store()
+    path = store.acquire(_store_key(video_id))
+    if path:
+        metrics.incr("audio.store.hit")
+        return path
+    metrics.incr("audio.store.miss")
+    if not await schedule_download(video_id):
+        return None
+    return store.acquire(_store_key(video_id))
+
+
+def release_audio(video_id: str):
+    """Releases a file returned by acquire_audio(); it may be evicted afterwards."""
+    _get_store().release(_store_key(video_id))
@@ -0,0 +1,216 @@
+"""
+On-Disk Audio Store.
+Keeps downloaded audio files so a video is downloaded once and reused across
+target languages and retries. Files are keyed by video id and download format,
+listed in a small JSON index next to them, and evicted least-recently-used once
+the directory holds more than its byte budget.
+
+One directory is shared by every app process: each change to the index is made
+under an exclusive flock on a lock file, re-reading the index first. A file in
+use (e.g. while being uploaded to Gemini) is held open with a shared flock, and
+eviction skips files it can't lock exclusively, so files used by any process
+are never evicted. The kernel drops the locks of a process that dies.
+
+New downloads are written to the staging directory and then added.
+"""
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = ".lock"
+STAGING_DIRNAME = "downloads"
+# Staged files untouched for this long belong to downloads that died
+STAGING_MAX_AGE_SECONDS = 3600
+
+
+class _Entry(NamedTuple):
+    path: str
+    size: int
+    last_access: float
+
+
+class AudioStore:
+    """
+    Size-bounded LRU of audio files in one directory, shared between processes.
+    All methods are synchronous and don't await, so they are atomic within the event loop.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: dict[str, _Entry] = {}
+        # Files this process uses: the open file holding the shared lock, and a refcount
+        self._held: dict[str, tuple[IO, int]] = {}
+        self.staging_directory = self.directory / STAGING_DIRNAME
+        self.staging_directory.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            self._remove_strays()
+            self._evict()
+            self._save_index()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(video_id: str, format_tag: str) -> str:
+        return f"{video_id}.{format_tag}"
+
+    @contextmanager
+    def _locked(self):
+        """Holds the store-wide lock, with the index freshly loaded."""
+        with open(self.directory / LOCK_FILENAME, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._load_index()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            raw = json.loads((self.directory / INDEX_FILENAME).read_text())
+        except FileNotFoundError:
+            raw = {}
+        except Exception as e:
+            logger.warning(f"Audio store index unreadable, starting empty: {e}")
+            raw = {}
+
+        self._entries = {}
+        self.current_bytes = 0
+        for key, (path, size, last_access) in raw.items():
+            if os.path.exists(path):
+                self._entries[key] = _Entry(path, size, last_access)
+                self.current_bytes += size
+
+    def _save_index(self):
+        tmp = self.directory / f"{INDEX_FILENAME}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps({key: list(entry) for key, entry in self._entries.items()}))
+        os.replace(tmp, self.directory / INDEX_FILENAME)
+
+    def _remove_strays(self):
+        """Removes files missing from the index and abandoned downloads (under the lock)."""
+        known = {os.path.abspath(entry.path) for entry in self._entries.values()}
+        for file in self.directory.iterdir():
+            if file.name in (INDEX_FILENAME, LOCK_FILENAME) or not file.is_file():
+                continue
+            if os.path.abspath(file) not in known:
+                self._remove_file(str(file))
+
+        # Other processes may be downloading right now, so only stale files go
+        cutoff = time.time() - STAGING_MAX_AGE_SECONDS
+        for file in self.staging_directory.iterdir():
+            try:
+                if file.stat().st_mtime < cutoff:
+                    self._remove_file(str(file))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to remove audio file {path}: {e}")
+
+    def acquire(self, key: str) -> str | None:
+        """
+        Returns the file for 'key' and takes a reference on it, or None if it
+        isn't stored. Every successful acquire must be paired with a release.
+        """
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            held = self._held.get(key)
+            if held is None:
+                try:
+                    file = open(entry.path, "rb")
+                except FileNotFoundError:
+                    # Removed behind our back
+                    self._drop(key)
+                    self._save_index()
+                    return None
+                # Never blocks: evicting takes the store lock, which we hold
+                fcntl.flock(file, fcntl.LOCK_SH)
+                held = (file, 0)
+            self._held[key] = (held[0], held[1] + 1)
+            self._entries[key] = entry._replace(last_access=time.time())
+            self._save_index()
+            return entry.path
+
+    def release(self, key: str):
+        file, count = self._held.get(key, (None, 0))
+        if count > 1:
+            self._held[key] = (file, count - 1)
+            return
+        self._held.pop(key, None)
+        if file is not None:
+            file.close()
+        # Eviction may have been held back by this reference
+        if self.current_bytes > self.max_bytes:
+            with self._locked():
+                self._evict()
+                self._save_index()
+
+    def add(self, key: str, downloaded_path: str) -> str:
+        """
+        Moves a finished download into the store under 'key' and returns its
+        final path. If another process stored the same key meanwhile, that file
+        is kept and the download discarded. Older files nobody uses are evicted
+        if over the byte budget.
+        """
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove_file(downloaded_path)
+                return entry.path
+
+            extension = Path(downloaded_path).suffix
+            final_path = str(self.directory / f"{key}{extension}")
+            os.replace(downloaded_path, final_path)
+            size = os.path.getsize(final_path)
+            self._entries[key] = _Entry(final_path, size, time.time())
+            self.current_bytes += size
+            self._evict(keep=key)
+            self._save_index()
+            return final_path
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+        self._remove_file(entry.path)
+
+    @staticmethod
+    def _in_use(path: str) -> bool:
+        """Whether any process holds the file (see acquire)."""
+        try:
+            with open(path, "rb") as file:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _evict(self, keep: str | None = None):
+        """Drops least recently used files until within budget (under the lock)."""
+        if self.current_bytes <= self.max_bytes:
+            return
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1].last_access):
+            if self.current_bytes <= self.max_bytes:
+                break
+            if key == keep or key in self._held or self._in_use(entry.path):
+                continue
+            logger.info(f"Evicting audio {key} from the audio store")
+            self._drop(key)
@@ -0,0 +1,97 @@
+"""
+Transcript Compaction.
+Auto-generated captions arrive as thousands of 2-3 second fragments, and
+rolling captions repeat the tail of the previous fragment. Before a transcript
+goes into a prompt it is deduplicated and merged into ~30s windows with one
+MM:SS stamp each, widening the windows until the text fits the character budget.
+"""
+import re
+from app.core.config import (
+    TRANSCRIPT_COMPACT_WINDOW_SECONDS,
+    TRANSCRIPT_COMPACT_MAX_WINDOW_SECONDS,
+    TRANSCRIPT_PROMPT_CHAR_BUDGET,
+)
+from app.utils.helpers import format_timestamp
+
+_SENTENCE_END_RE = re.compile(r"[.!?…。！？]['\")\]]*$")
+
+# Longest repeated word run between neighbouring fragments that is checked
+_MAX_OVERLAP_WORDS = 20
+# Shorter runs are too often really said twice ("no" + "no means no", "you know" + "you know what")
+_MIN_OVERLAP_WORDS = 3
+
+
+def _overlap(previous: list[str], current: list[str]) -> int:
+    """Number of leading words of 'current' that repeat the end of 'previous' (0 if under _MIN_OVERLAP_WORDS)."""
+    for size in range(min(len(previous), len(current), _MAX_OVERLAP_WORDS), _MIN_OVERLAP_WORDS - 1, -1):
+        if [w.lower() for w in previous[-size:]] == [w.lower() for w in current[:size]]:
+            return size
+    return 0
+
+
+def dedupe_rolling_captions(transcript_data: list[dict]) -> list[dict]:
+    """
+    Removes rolling-caption repeats: words that only repeat the previous
+    fragment's ending (at least _MIN_OVERLAP_WORDS of them) are cut, and
+    fragments left empty are dropped.
+    Returns new segment dicts; the input is left untouched.
+    """
+    result = []
+    previous_words: list[str] = []
+    for seg in transcript_data:
+        words = seg["text"].replace("\n", " ").split()
+        if not words:
+            continue
+        words = words[_overlap(previous_words, words):]
+        if not words:
+            continue
+        result.append({"text": " ".join(words), "start": seg["start"], "duration": seg.get("duration", 0.0)})
+        # Compare against what was actually said, not just what was kept
+        previous_words = (previous_words + words)[-_MAX_OVERLAP_WORDS:]
+    return result
+
+
+def _merge_windows(segments: list[dict], window_seconds: float) -> list[tuple[float, str]]:
+    """
+    Groups segments into windows of about 'window_seconds'. A window is closed
+    at the first sentence end after that length, or at 1.5x the length at the latest.
+    """
+    windows = []
+    window_start, texts = None, []
+    for seg in segments:
+        if window_start is None:
+            window_start = seg["start"]
+        texts.append(seg["text"])
+        elapsed = seg["start"] + seg.get("duration", 0.0) - window_start
+        if elapsed >= window_seconds * 1.5 or (
+            elapsed >= window_seconds and _SENTENCE_END_RE.search(seg["text"])
+        ):
+            windows.append((window_start, " ".join(texts)))
+            window_start, texts = None, []
+    if texts:
+        windows.append((window_start, " ".join(texts)))
+    return windows
+
+
+def _render(windows: list[tuple[float, str]]) -> str:
+    return "\n".join(f"{format_timestamp(start)} {text}" for start, text in windows)
+
+
+def compact_transcript(
+    transcript_data: list[dict],
+    char_budget: int = TRANSCRIPT_PROMPT_CHAR_BUDGET,
+    window_seconds: int = TRANSCRIPT_COMPACT_WINDOW_SECONDS,
+    max_window_seconds: int = TRANSCRIPT_COMPACT_MAX_WINDOW_SECONDS,
+) -> str:
+    """
+    Prompt text for a transcript: one "MM:SS text" line per window.
+    Windows start at 'window_seconds' and double (up to 'max_window_seconds')
+    while the text is over 'char_budget'. Wider windows only save stamps, never
+    words, so a transcript that is still too long is left to map-reduce.
+    """
+    segments = dedupe_rolling_captions(transcript_data)
+    text = _render(_merge_windows(segments, window_seconds))
+    while len(text) > char_budget and window_seconds < max_window_seconds:
+        window_seconds = min(window_seconds * 2, max_window_seconds)
+        text = _render(_merge_windows(segments, window_seconds))
+    return text
@@ -0,0 +1,152 @@
+"""
+Hedged Transcript Router.
+Fetches transcripts through several IVideoExtractor backends. The healthier
+backend (by recent success rate, then p90 latency) is asked first; if it hasn't
+answered within its own observed p90, the next one is asked too and whichever
+succeeds first wins. A backend that fails outright is followed up immediately.
+A backend reporting that the video has no transcript isn't counted as unhealthy.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Any, List, Tuple
+from fastapi import HTTPException
+from app.core import metrics
+from app.core.config import (
+    TRANSCRIPT_HEDGE_ENABLED,
+    TRANSCRIPT_HEDGE_DEFAULT_DELAY_SECONDS,
+    TRANSCRIPT_HEDGE_MAX_DELAY_SECONDS,
+)
+from app.services.extractors.base import IVideoExtractor
+from app.services.extractors.youtube_transcript_api_adapter import YouTubeTranscriptAPIAdapter
+from app.services.extractors.yt_dlp_adapter import YTDLPExtractor
+from app.services.transcript import TranscriptUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Latency samples needed before the observed p90 replaces the default hedge delay
+MIN_SAMPLES = 20
+MIN_HEDGE_DELAY_SECONDS = 0.5
+
+
+class _ExtractorStats:
+    def __init__(self, window: int = 200, decay: float = 0.05):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.success_rate = 1.0
+        self.decay = decay
+
+    def record(self, ok: bool, latency: float):
+        self.success_rate += self.decay * ((1.0 if ok else 0.0) - self.success_rate)
+        if ok:
+            self.latencies.append(latency)
+
+    def p90(self) -> float | None:
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+
+class TranscriptRouter:
+    def __init__(self, extractors: Dict[str, IVideoExtractor]):
+        self.extractors = extractors
+        self.stats = {name: _ExtractorStats() for name in extractors}
+        for name, stats in self.stats.items():
+            metrics.register_gauge(f"transcript.extractor.{name}.success_rate", lambda s=stats: round(s.success_rate, 3))
+            metrics.register_gauge(f"transcript.extractor.{name}.p90_seconds", lambda s=stats: s.p90())
+
+    def _ranked(self) -> List[str]:
+        """
+        Extractor names, healthiest first (registration order breaks ties).
+        An unknown p90 ranks last, so a backend only moves ahead on latency
+        once it has the samples to show it is faster.
+        """
+        order = list(self.extractors)
+
+        def latency(name: str) -> float:
+            p90 = self.stats[name].p90()
+            return math.inf if p90 is None else p90
+
+        return sorted(
+            order,
+            key=lambda name: (-round(self.stats[name].success_rate, 1), latency(name), order.index(name)),
+        )
+
+    def _hedge_delay(self, name: str) -> float:
+        p90 = self.stats[name].p90()
+        if p90 is None:
+            return TRANSCRIPT_HEDGE_DEFAULT_DELAY_SECONDS
+        return min(max(p90, MIN_HEDGE_DELAY_SECONDS), TRANSCRIPT_HEDGE_MAX_DELAY_SECONDS)
+
+    async def _attempt(self, name: str, video_id: str, lang: str) -> Tuple[List[Dict[str, Any]], str]:
+        started = time.monotonic()
+        try:
+            result = await self.extractors[name].get_transcript(video_id, lang)
+        except asyncio.CancelledError:
+            # Lost the race - says nothing about this extractor
+            raise
+        except TranscriptUnavailable:
+            # A valid answer (the video has no captions), so it counts as a success
+            self.stats[name].record(True, time.monotonic() - started)
+            raise
+        except Exception:
+            self.stats[name].record(False, time.monotonic() - started)
+            raise
+        self.stats[name].record(True, time.monotonic() - started)
+        return result
+
+    async def get_transcript(self, video_id: str, lang: str = "auto") -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Returns (transcript_data, language) from the first extractor that succeeds.
+        Raises the first extractor's error if all of them fail.
+        """
+        ranked = self._ranked()
+        pending: dict[asyncio.Task, str] = {}
+        errors: list[BaseException] = []
+
+        def start(name: str):
+            pending[asyncio.create_task(self._attempt(name, video_id, lang))] = name
+
+        start(ranked[0])
+        remaining = ranked[1:]
+        try:
+            while pending:
+                hedge = TRANSCRIPT_HEDGE_ENABLED and bool(remaining)
+                timeout = self._hedge_delay(pending[next(iter(pending))]) if hedge and len(pending) == 1 else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # The current extractor is slower than its p90: ask the next one as well
+                    metrics.incr("transcript.hedge.fired")
+                    start(remaining.pop(0))
+                    continue
+
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        if name != ranked[0]:
+                            metrics.incr(f"transcript.hedge.won.{name}")
+                        return task.result()
+                    errors.append(task.exception())
+                    logger.info(f"Transcript extractor '{name}' failed for video {video_id}")
+
+                if not pending and remaining:
+                    start(remaining.pop(0))
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise errors[0] if errors else HTTPException(status_code=404, detail="Transcript unavailable for this video")
+
+
+transcript_router = TranscriptRouter({
+    "transcript_api": YouTubeTranscriptAPIAdapter(),
+    "yt_dlp": YTDLPExtractor(),
+})
+
+
+async def fetch_transcript(video_id: str, lang: str = "auto") -> Tuple[List[Dict[str, Any]], str]:
+    """Fetches a transcript through the shared router (a plain function, for the cache layer)."""
+    return await transcript_router.get_transcript(video_id, lang)
@@ -1,6 +1,6 @@
 from typing import Dict, Any, List, Tuple
 from app.services.extractors.base import IVideoExtractor
-from app.api.api import fetch_youtube_transcript
+from app.services.transcript import fetch_youtube_transcript
 
 class YouTubeTranscriptAPIAdapter(IVideoExtractor):
     """
@@ -1,13 +1,111 @@
+import asyncio
+import logging
+import yt_dlp
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Tuple
+from fastapi import HTTPException
+from app.core import metrics
+from app.core.config import YTDLP_EXTRACT_WORKERS, YTDLP_EXTRACT_QUEUE_SIZE
+from app.core.http_client import get_http_client
+from app.core.retry import retry_policy
 from app.services.extractors.base import IVideoExtractor
+from app.services.transcript import TranscriptUnavailable
 from app.services.youtube import get_video_metadata
 
+logger = logging.getLogger(__name__)
+
+# Kept apart from the default executor: extractions are slow, and one abandoned by
+# a lost hedge keeps its thread until yt-dlp returns
+_extract_executor = ThreadPoolExecutor(max_workers=YTDLP_EXTRACT_WORKERS, thread_name_prefix="ytdlp-extract")
+# Submitted and not yet finished, including those nobody waits for any more
+_extracts_pending = 0
+
+metrics.register_gauge("transcript.ytdlp.extracts_pending", lambda: _extracts_pending)
+
+
+def _extract_subtitle_tracks(video_id: str) -> Dict[str, Any]:
+    """Reads the video's subtitle listings with yt-dlp (no download)."""
+    ydl_opts = {
+        'skip_download': True,
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': 15,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:  # type: ignore
+        info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+    return {
+        "subtitles": info.get("subtitles") or {},
+        "automatic_captions": info.get("automatic_captions") or {},
+        "language": info.get("language"),
+    }
+
+
+def _extract_finished(future: asyncio.Future):
+    global _extracts_pending
+    _extracts_pending -= 1
+    if not future.cancelled():
+        # Mark the error as retrieved if the caller went away
+        future.exception()
+
+
+async def _extract_in_pool(video_id: str) -> Dict[str, Any]:
+    """Runs _extract_subtitle_tracks in the bounded pool, failing fast once it is backed up."""
+    global _extracts_pending
+    if _extracts_pending >= YTDLP_EXTRACT_WORKERS + YTDLP_EXTRACT_QUEUE_SIZE:
+        metrics.incr("transcript.ytdlp.rejected")
+        raise HTTPException(status_code=503, detail="yt-dlp extraction pool is busy")
+    _extracts_pending += 1
+    future = asyncio.get_running_loop().run_in_executor(_extract_executor, _extract_subtitle_tracks, video_id)
+    future.add_done_callback(_extract_finished)
+    # Shielded so the count only drops once the thread is really done
+    return await asyncio.shield(future)
+
+
+def _pick_track(tracks: Dict[str, Any], lang: str) -> Tuple[List[Dict[str, Any]], str] | None:
+    """
+    Picks the subtitle formats to use, mirroring the transcript API's choice:
+    manual subtitles before automatic captions, English first for "auto".
+    Returns (formats, language_code) or None.
+    """
+    manual, automatic = tracks["subtitles"], tracks["automatic_captions"]
+    original = tracks["language"]
+    wanted = "en" if lang == "auto" else lang
+    # Automatic captions are offered machine-translated into every language;
+    # only the video's own language ('-orig') is a real transcript
+    candidates = [(manual, wanted), (automatic, f"{wanted}-orig")]
+    if wanted == original:
+        candidates.append((automatic, wanted))
+    if lang == "auto":
+        candidates += [(manual, code) for code in manual]
+        if original:
+            candidates += [(automatic, f"{original}-orig"), (automatic, original)]
+
+    for source, code in candidates:
+        if source.get(code):
+            return source[code], code.removesuffix("-orig")
+    return None
+
+
+def _parse_json3(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    segments = []
+    for event in data.get("events", []):
+        text = "".join(seg.get("utf8", "") for seg in event.get("segs") or []).strip()
+        if not text:
+            continue
+        segments.append({
+            "text": text,
+            "start": event.get("tStartMs", 0) / 1000,
+            "duration": event.get("dDurationMs", 0) / 1000,
+        })
+    return segments
+
+
 class YTDLPExtractor(IVideoExtractor):
     """
     Extractor implementation using yt-dlp for metadata and fallback transcript extraction.
-    Currently wraps existing functionality.
+    Transcripts come from the subtitle tracks yt-dlp lists, downloaded as json3.
     """
-    
+
     async def get_metadata(self, video_id: str) -> Dict[str, Any]:
         """Uses yt-dlp to fetch video metadata."""
         metadata = await get_video_metadata(video_id)
@@ -15,10 +113,30 @@ class YTDLPExtractor(IVideoExtractor):
             return {}
         return metadata
 
+    @retry_policy("ytdlp_transcript", attempts=2, min_wait=1, max_wait=3)
+    async def _fetch_transcript_once(self, video_id: str, lang: str) -> Tuple[List[Dict[str, Any]], str] | None:
+        tracks = await _extract_in_pool(video_id)
+        picked = _pick_track(tracks, lang)
+        if picked is None:
+            return None
+        formats, language_code = picked
+        track = next((f for f in formats if f.get("ext") == "json3"), None)
+        if track is None:
+            return None
+
+        response = await get_http_client().get(track["url"])
+        response.raise_for_status()
+        return _parse_json3(response.json()), language_code
+
     async def get_transcript(self, video_id: str, lang: str = "auto") -> Tuple[List[Dict[str, Any]], str]:
-        """
-        Ideally yt-dlp could extract subtitles, but for now we delegate this 
-        to the specialized transcript API.
-        """
-        # In a full implementation, this could call yt-dlp's subtitle extractors
-        raise NotImplementedError("yt-dlp transcript extraction not fully implemented here yet.")
+        """Uses yt-dlp's subtitle listings to fetch the transcript."""
+        try:
+            result = await self._fetch_transcript_once(video_id, lang)
+        except Exception as e:
+            logger.warning(f"yt-dlp transcript fetch failed for video {video_id}: {str(e)}")
+            raise HTTPException(
+                status_code=404, detail="Transcript unavailable for this video"
+            )
+        if not result or not result[0]:
+            raise TranscriptUnavailable()
+        return result
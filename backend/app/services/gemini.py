@@ -1,34 +1,164 @@
 """
 Google Gemini AI Service.
 Handles the interaction with Google's Generative AI to create summaries.
+
+Transcripts longer than MAX_TRANSCRIPT_LENGTH are summarized map-reduce style:
+the transcript is split into windows on segment boundaries, each window is
+summarized concurrently (and cached on its own), and a final call merges the
+partial summaries into the usual JSON structure.
+
+Every Gemini call goes through one gateway: an adaptive concurrency limit with
+a bounded wait queue, and a circuit breaker. Calls it rejects raise
+GeminiUnavailable (a 503) straight away and are not retried.
 """
 
+import asyncio
+import hashlib
 import logging
 import json
+import math
+import time
+from contextlib import asynccontextmanager
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from fastapi import HTTPException
-from tenacity import retry, wait_exponential, stop_after_attempt
-from app.core.config import GEMINI_API_KEY
+from app.core import metrics
+from app.core.cache import get_cached_or_fetch
+from app.core.concurrency import AdaptiveLimiter, CircuitBreaker, Overloaded
+from app.core.retry import retry_policy
+from app.core.config import (
+    GEMINI_API_KEY,
+    GEMINI_INITIAL_CONCURRENCY,
+    GEMINI_MIN_CONCURRENCY,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_QUEUE_SIZE,
+    GEMINI_QUEUE_TIMEOUT_SECONDS,
+    GEMINI_LATENCY_TARGET_SECONDS,
+    GEMINI_BREAKER_FAILURES,
+    GEMINI_BREAKER_COOLDOWN_SECONDS,
+    GEMINI_CALL_TIMEOUT_SECONDS,
+    SUMMARY_CHUNK_CHARS,
+    SUMMARY_MAP_CONCURRENCY,
+    SUMMARY_HARD_TTL_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
+# Longest transcript summarized in a single prompt
+MAX_TRANSCRIPT_LENGTH = 100000
+
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel("gemini-3.1-flash-lite")
 
-
-@retry(
-    stop=stop_after_attempt(4),
-    wait=wait_exponential(multiplier=1, min=2, max=15),
-    reraise=True
+_limiter = AdaptiveLimiter(
+    initial_limit=GEMINI_INITIAL_CONCURRENCY,
+    min_limit=GEMINI_MIN_CONCURRENCY,
+    max_limit=GEMINI_MAX_CONCURRENCY,
+    max_queue=GEMINI_QUEUE_SIZE,
+    latency_target=GEMINI_LATENCY_TARGET_SECONDS,
 )
-async def generate_structured_summary(
-    transcript_str: str, description: str = "", target_lang: str = "English"
-) -> dict:
+_breaker = CircuitBreaker(GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN_SECONDS)
+
+metrics.register_gauge("gemini.limit", lambda: round(_limiter.limit, 2))
+metrics.register_gauge("gemini.inflight", lambda: _limiter.inflight)
+metrics.register_gauge("gemini.queued", lambda: _limiter.queued)
+metrics.register_gauge("gemini.breaker", lambda: _breaker.state)
+
+# Gemini telling us to slow down (429 / quota exhausted)
+_OVERLOAD_ERRORS = (google_exceptions.TooManyRequests,)
+# Gemini being unhealthy (5xx, deadline exceeded)
+_UPSTREAM_ERRORS = (google_exceptions.ServerError, asyncio.TimeoutError)
+
+
+class GeminiUnavailable(HTTPException):
+    """A Gemini call rejected by the gateway (circuit open or too many calls waiting)."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail="The AI service is busy right now. Please try again shortly.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+class _Call:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_token_at: float | None = None
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+
+@asynccontextmanager
+async def _gateway():
+    """Admits one Gemini call and feeds its outcome back into the limiter and breaker."""
+    try:
+        _breaker.before_call()
+        try:
+            await _limiter.acquire(GEMINI_QUEUE_TIMEOUT_SECONDS)
+        except BaseException:
+            _breaker.on_ignored()
+            raise
+    except Overloaded as e:
+        metrics.incr(f"gemini.rejected.{e.reason}")
+        raise GeminiUnavailable(e.retry_after)
+
+    call = _Call()
+    try:
+        yield call
+    except _OVERLOAD_ERRORS:
+        metrics.incr("gemini.overloaded")
+        _limiter.on_overload(call.started)
+        _breaker.on_failure()
+        raise
+    except _UPSTREAM_ERRORS:
+        metrics.incr("gemini.upstream_errors")
+        _breaker.on_failure()
+        raise
+    except BaseException:
+        # Bad request, cancelled caller, ... - says nothing about Gemini's health
+        _breaker.on_ignored()
+        raise
+    else:
+        # Streams are judged by their time to first token, not by the answer's length
+        latency = (call.first_token_at or time.monotonic()) - call.started
+        metrics.observe("gemini.latency_seconds", latency)
+        _limiter.on_success(latency, call.started)
+        _breaker.on_success()
+    finally:
+        _limiter.release()
+
+
+async def _generate(contents):
+    async with _gateway():
+        # A hung call would hold its slot forever; timing out counts as an upstream failure
+        return await asyncio.wait_for(model.generate_content_async(contents), GEMINI_CALL_TIMEOUT_SECONDS)
+
+
+async def _generate_stream(contents):
     """
-    Sends the video transcript to Gemini AI with a specific 'system prompt'.
-    The prompt instructs Gemini to return a very specific JSON structure.
+    Yields the response text chunks; the gateway slot is held until the stream ends.
+    GEMINI_CALL_TIMEOUT_SECONDS applies to the first chunk and to every gap between chunks.
     """
-    MAX_TRANSCRIPT_LENGTH = 100000
+    async with _gateway() as call:
+        response = await asyncio.wait_for(
+            model.generate_content_async(contents, stream=True), GEMINI_CALL_TIMEOUT_SECONDS
+        )
+        chunks = aiter(response)
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(chunks), GEMINI_CALL_TIMEOUT_SECONDS)
+            except StopAsyncIteration:
+                break
+            call.first_token()
+            if chunk.text:
+                yield chunk.text
+
+
+def _build_summary_prompt(transcript_str: str, description: str, target_lang: str) -> str:
+    """Builds the structured-summary prompt (shared by the normal and streaming calls)."""
     if len(transcript_str) > MAX_TRANSCRIPT_LENGTH:
         transcript_str = transcript_str[:MAX_TRANSCRIPT_LENGTH] + "\n[TRUNCATED]"
 
@@ -73,29 +203,212 @@ async def generate_structured_summary(
     Transcription:
     {transcript_str}
     """
+    return prompt
+
+
+def _extract_json(text: str) -> dict:
+    # Simple extraction of the JSON block if it's wrapped in markdown
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0].strip()
 
+    return json.loads(text)
+
+
+def needs_chunking(transcript_str: str) -> bool:
+    """True if the transcript is too long for a single summary prompt."""
+    return len(transcript_str) > MAX_TRANSCRIPT_LENGTH
+
+
+async def generate_structured_summary(
+    transcript_str: str, description: str = "", target_lang: str = "English"
+) -> dict:
+    """
+    Sends the video transcript to Gemini AI with a specific 'system prompt'.
+    The prompt instructs Gemini to return a very specific JSON structure.
+    Long transcripts go through the map-reduce path instead of being truncated.
+    """
+    if needs_chunking(transcript_str):
+        return await _map_reduce_summary(transcript_str, description, target_lang)
+    return await _summarize_in_one_prompt(transcript_str, description, target_lang)
+
+
+def _split_transcript(transcript_str: str, max_chars: int) -> list[str]:
+    """Splits the timestamped transcript into windows on line (segment) boundaries."""
+    chunks, current, size = [], [], 0
+    for line in transcript_str.split("\n"):
+        if current and size + len(line) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+@retry_policy("gemini", attempts=4, min_wait=2, max_wait=15)
+async def _summarize_chunk(chunk: str, part: int, total_parts: int, target_lang: str) -> dict:
+    """Map step: a partial summary of one window of the transcript."""
+    prompt = f"""
+    You are summarizing part {part} of {total_parts} of a long YouTube video transcript.
+    Each line starts with the time (MM:SS) at which it is spoken.
+
+    IMPORTANT: Your response MUST be written fluently in {target_lang}.
+
+    Return a JSON object with this structure:
+    {{
+      "summary": "What this part covers in {target_lang} (3-6 sentences)",
+      "key_topics": [
+        {{"topic": "Name of topic", "timestamp": "Start time in MM:SS format (HH:MM:SS past one hour)"}}
+      ],
+      "insights": ["Specific actionable advice from this part"]
+    }}
+
+    Return ONLY the JSON object, no other text.
+
+    Transcript part {part}:
+    {chunk}
+    """
     try:
-        response = await model.generate_content_async(prompt)
-        text = response.text
-        
-        # Simple extraction of the JSON block if it's wrapped in markdown
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0].strip()
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0].strip()
-            
-        return json.loads(text)
+        response = await _generate(prompt)
+        return _extract_json(response.text)
+    except GeminiUnavailable:
+        raise
     except Exception as e:
-        logger.error(f"Gemini API Error: {str(e)}")
+        logger.error(f"Gemini API Error (chunk {part}/{total_parts}): {str(e)}")
         raise HTTPException(
             status_code=500, detail="AI summary generation failed. Please try again."
+        ) from e
+
+
+@retry_policy("gemini", attempts=4, min_wait=2, max_wait=15)
+async def _reduce_partial_summaries(partials: list[dict], description: str, target_lang: str) -> dict:
+    """Reduce step: merges the partial summaries into the final structure."""
+    chapters_context = ""
+    if description:
+        chapters_context = (
+            f"\nVideo Description/Chapters context:\n{description[:5000]}\n"
         )
 
-@retry(
-    stop=stop_after_attempt(4),
-    wait=wait_exponential(multiplier=1, min=2, max=15),
-    reraise=True
-)
+    prompt = f"""
+    Below are partial summaries of consecutive parts of one long YouTube video, in order.
+    Merge them into a single professional, high-utility structured summary of the whole video.
+    {chapters_context}
+
+    Guidelines:
+    - If the creator has defined chapters in the description, use them to structure the key topics.
+    - Key topics MUST keep the timestamps given in the partial summaries and cover the whole video.
+    - Keep only the most valuable, non-overlapping actionable insights.
+
+    IMPORTANT: Your response MUST be written fluently in {target_lang}.
+
+    Return a JSON object with this structure:
+    {{
+      "title": "Optimized Video Title in {target_lang}",
+      "summary": "Executive summary of the main content in {target_lang} (3-5 sentences)",
+      "key_topics": [
+        {{"topic": "Name of topic/chapter", "timestamp": "Start time in MM:SS format"}}
+      ],
+      "actionable_insights": [
+        "Insight 1: Specific actionable advice with context"
+      ]
+    }}
+
+    Return ONLY the JSON object, no other text.
+
+    Partial summaries:
+    {json.dumps(partials, ensure_ascii=False)}
+    """
+    try:
+        response = await _generate(prompt)
+        return _extract_json(response.text)
+    except GeminiUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Gemini API Error (reduce): {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="AI summary generation failed. Please try again."
+        ) from e
+
+
+async def _map_reduce_summary(transcript_str: str, description: str, target_lang: str) -> dict:
+    chunks = _split_transcript(transcript_str, SUMMARY_CHUNK_CHARS)
+    logger.info(f"Summarizing long transcript ({len(transcript_str)} chars) in {len(chunks)} parts")
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+    async def summarize_part(part: int, chunk: str) -> dict:
+        # Cached per chunk content, so a re-run only recomputes the parts that failed
+        digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:32]
+        async with semaphore:
+            return await get_cached_or_fetch(
+                f"summary_chunk:{digest}:{target_lang}",
+                _summarize_chunk,
+                chunk,
+                part,
+                len(chunks),
+                target_lang,
+                ttl=SUMMARY_HARD_TTL_SECONDS,
+                durable=True,
+            )
+
+    results = await asyncio.gather(
+        *(summarize_part(i + 1, chunk) for i, chunk in enumerate(chunks)),
+        return_exceptions=True,
+    )
+    failed = [i + 1 for i, result in enumerate(results) if isinstance(result, BaseException)]
+    for result in results:
+        if isinstance(result, GeminiUnavailable):
+            raise result
+    if failed:
+        logger.error(f"{len(failed)} of {len(chunks)} transcript parts failed to summarize: {failed}")
+        raise HTTPException(
+            status_code=500, detail="AI summary generation failed. Please try again."
+        )
+
+    return await _reduce_partial_summaries(list(results), description, target_lang)
+
+
+@retry_policy("gemini", attempts=4, min_wait=2, max_wait=15)
+async def _summarize_in_one_prompt(
+    transcript_str: str, description: str = "", target_lang: str = "English"
+) -> dict:
+    prompt = _build_summary_prompt(transcript_str, description, target_lang)
+
+    try:
+        response = await _generate(prompt)
+        return _extract_json(response.text)
+    except GeminiUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Gemini API Error: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="AI summary generation failed. Please try again."
+        ) from e
+
+
+async def stream_structured_summary(
+    transcript_str: str, description: str = "", target_lang: str = "English"
+):
+    """
+    Streaming version of generate_structured_summary.
+    Yields the raw JSON text as Gemini produces it (no retries, since
+    chunks already sent can't be taken back).
+    """
+    prompt = _build_summary_prompt(transcript_str, description, target_lang)
+    try:
+        async for text in _generate_stream(prompt):
+            yield text
+    except GeminiUnavailable:
+        raise
+    except Exception as e:
+        logger.error(f"Gemini Streaming API Error: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail="AI summary generation failed. Please try again."
+        ) from e
+
+@retry_policy("gemini", attempts=4, min_wait=2, max_wait=15)
 async def generate_summary_from_audio(filepath: str, description: str = "", target_lang: str = "English") -> dict:
     """
     Uploads audio to Gemini and generates a structured summary.
@@ -134,7 +447,7 @@ async def generate_summary_from_audio(filepath: str, description: str = "", targ
           ]
         }}
         """
-        response = await model.generate_content_async([prompt, audio_file])
+        response = await _generate([prompt, audio_file])
         text = response.text
         
         if "```json" in text:
@@ -143,32 +456,49 @@ async def generate_summary_from_audio(filepath: str, description: str = "", targ
             text = text.split("```")[1].split("```")[0].strip()
             
         return json.loads(text)
+    except GeminiUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Gemini API Audio Error: {str(e)}")
         raise HTTPException(
             status_code=500, detail="AI summary generation from audio failed. Please try again."
-        )
+        ) from e
 
-async def chat_with_video(transcript: str, question: str):
+async def chat_with_video(transcript: str, question: str, excerpts: bool = False):
     """
     Answers a user's question based strictly on the provided transcript.
     Yields chunks of text for Server-Sent Events (SSE).
+    With 'excerpts', the transcript is only the retrieved windows relevant to the question.
     """
+    if excerpts:
+        context = f"""The following transcript excerpts are the parts of the video most relevant to the question.
+    Each excerpt starts with its time range; mention the time when it helps the user.
+
+    TRANSCRIPT EXCERPTS:
+    {transcript}"""
+    else:
+        context = f"""TRANSCRIPT:
+    {transcript[:80000]}"""
+
     prompt = f"""
     You are an AI assistant answering questions about a specific YouTube video.
     Use ONLY the provided transcript to answer the question. If the answer is not in the transcript, 
     say "I cannot answer this based on the video content." Do not use outside knowledge.
     
-    TRANSCRIPT:
-    {transcript[:80000]}
+    {context}
     
     QUESTION: {question}
     """
+    mode = "retrieval" if excerpts else "full"
+    metrics.observe(f"chat.prompt_chars.{mode}", len(prompt))
+    started = time.monotonic()
+    first_chunk = True
     try:
-        response = await model.generate_content_async(prompt, stream=True)
-        async for chunk in response:
-            if chunk.text:
-                yield chunk.text
+        async for text in _generate_stream(prompt):
+            if first_chunk:
+                metrics.observe(f"chat.ttft_seconds.{mode}", time.monotonic() - started)
+                first_chunk = False
+            yield text
     except Exception as e:
         logger.error(f"Gemini Chat API Error: {str(e)}")
         yield "Sorry, I encountered an error while analyzing the video."
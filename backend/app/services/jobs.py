@@ -0,0 +1,305 @@
+"""
+Background Summarization Jobs.
+A Redis-backed job queue for summaries that would otherwise hold an HTTP
+request open for minutes (long videos, the audio fallback). A pool of workers
+in each process runs the normal summary pipeline for queued jobs.
+
+Redis keys:
+  jobs:queue        list of job ids waiting to run
+  jobs:processing   sorted set of running job ids, scored by visibility deadline
+  jobs:delayed      sorted set of failed job ids waiting to be retried, scored by retry time
+  job:{id}          hash with status, stage, progress, attempts, result, ...
+  job:{id}:users    users whose history gets the summary when the job finishes
+  job_dedup:{video_id}:{lang}:{target_lang}   id of the job for that summary
+
+Running jobs keep extending their deadline; if a worker dies, the job goes back
+to the queue once the deadline passes (up to JOB_MAX_ATTEMPTS runs). A job
+that failed with a server-side error is retried after an exponential backoff
+(or the upstream's Retry-After, if longer).
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from fastapi import HTTPException
+from app.core import cache
+from app.core.config import (
+    JOB_WORKERS,
+    JOB_VISIBILITY_TIMEOUT_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RESULT_TTL_SECONDS,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_RETRY_MAX_SECONDS,
+)
+from app.services.pipeline import run_summary_pipeline, build_summary_response, record_history
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "jobs:queue"
+PROCESSING_KEY = "jobs:processing"
+DELAYED_KEY = "jobs:delayed"
+POLL_INTERVAL_SECONDS = 1.0
+
+# What build_summary_response adds around the structured summary
+_RESPONSE_FIELDS = ("video_id", "language", "full_transcript", "total_segments", "metadata")
+
+# Atomically move the oldest queued job into the processing set
+_CLAIM_SCRIPT = """
+local job_id = redis.call("RPOP", KEYS[1])
+if job_id then
+    redis.call("ZADD", KEYS[2], ARGV[1], job_id)
+end
+return job_id
+"""
+
+# Atomically move delayed jobs whose retry time has come back into the queue
+_PROMOTE_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, 100)
+for _, job_id in ipairs(due) do
+    redis.call("ZREM", KEYS[1], job_id)
+    redis.call("LPUSH", KEYS[2], job_id)
+end
+return #due
+"""
+
+_worker_tasks: list[asyncio.Task] = []
+
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _now() -> str:
+    return str(time.time())
+
+
+def _parse_job(job_id: str, raw: dict) -> dict:
+    job = {
+        "job_id": job_id,
+        "status": raw.get("status"),
+        "stage": raw.get("stage"),
+        "progress": int(raw.get("progress", 0)),
+        "video_id": raw.get("video_id"),
+        "lang": raw.get("lang"),
+        "target_lang": raw.get("target_lang"),
+        "attempts": int(raw.get("attempts", 0)),
+        "created_at": float(raw.get("created_at", 0)),
+        "updated_at": float(raw.get("updated_at", 0)),
+    }
+    if raw.get("error"):
+        job["error"] = raw["error"]
+    if raw.get("result"):
+        job["result"] = json.loads(raw["result"])
+    return job
+
+
+async def get_job(job_id: str, user_id: str | None = None) -> dict | None:
+    """Returns a job, or None if it doesn't exist (or doesn't belong to 'user_id')."""
+    redis_client = cache.redis_client
+    raw = await redis_client.hgetall(_job_key(job_id))
+    if not raw:
+        return None
+    if user_id is not None and not await redis_client.sismember(f"{_job_key(job_id)}:users", user_id):
+        return None
+    return _parse_job(job_id, raw)
+
+
+async def enqueue_job(user_id: str, video_id: str, lang: str, target_lang: str) -> dict:
+    """
+    Queues a summary job. If the same video/lang/target summary is already
+    queued, running or done, that job is returned instead (and the user is added to it).
+    """
+    redis_client = cache.redis_client
+    dedup_key = f"job_dedup:{video_id}:{lang}:{target_lang}"
+    job_id = uuid.uuid4().hex
+
+    if not await redis_client.set(dedup_key, job_id, nx=True, ex=JOB_RESULT_TTL_SECONDS):
+        existing_id = await redis_client.get(dedup_key)
+        existing = await get_job(existing_id) if existing_id else None
+        if existing and existing["status"] != "failed":
+            users_key = f"{_job_key(existing_id)}:users"
+            await redis_client.sadd(users_key, user_id)
+            await redis_client.expire(users_key, JOB_RESULT_TTL_SECONDS)
+            # Re-read after joining: a job that completed before we were added
+            # won't record our history, so do it from its stored result
+            existing = await get_job(existing_id) or existing
+            if existing["status"] == "completed":
+                await _record_history_from_response(user_id, target_lang, existing["result"])
+            return existing
+        # Previous job failed or expired - start a fresh one
+        await redis_client.set(dedup_key, job_id, ex=JOB_RESULT_TTL_SECONDS)
+
+    now = _now()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(_job_key(job_id), mapping={
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0,
+            "video_id": video_id,
+            "lang": lang,
+            "target_lang": target_lang,
+            # Whose share the scheduler charges the work to
+            "owner": user_id,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        pipe.expire(_job_key(job_id), JOB_RESULT_TTL_SECONDS)
+        pipe.sadd(f"{_job_key(job_id)}:users", user_id)
+        pipe.expire(f"{_job_key(job_id)}:users", JOB_RESULT_TTL_SECONDS)
+        pipe.lpush(QUEUE_KEY, job_id)
+        await pipe.execute()
+
+    logger.info(f"Queued job {job_id} for video {video_id} ({lang} -> {target_lang})")
+    return await get_job(job_id)
+
+
+async def _record_history_from_response(user_id: str, target_lang: str, response: dict):
+    result = {
+        "metadata": response["metadata"],
+        "structured_data": {key: value for key, value in response.items() if key not in _RESPONSE_FIELDS},
+    }
+    await record_history(user_id, response["video_id"], target_lang, result)
+
+
+async def _update(job_id: str, **fields):
+    fields["updated_at"] = _now()
+    await cache.redis_client.hset(_job_key(job_id), mapping=fields)
+
+
+async def _claim() -> str | None:
+    deadline = time.time() + JOB_VISIBILITY_TIMEOUT_SECONDS
+    return await cache.redis_client.eval(_CLAIM_SCRIPT, 2, QUEUE_KEY, PROCESSING_KEY, deadline)
+
+
+async def _requeue_expired():
+    """Puts jobs whose worker stopped extending their deadline back in the queue."""
+    redis_client = cache.redis_client
+    expired = await redis_client.zrangebyscore(PROCESSING_KEY, "-inf", time.time())
+    for job_id in expired:
+        # Only the worker that manages to remove the entry requeues it
+        if not await redis_client.zrem(PROCESSING_KEY, job_id):
+            continue
+        attempts = int(await redis_client.hget(_job_key(job_id), "attempts") or 0)
+        if attempts >= JOB_MAX_ATTEMPTS:
+            logger.warning(f"Job {job_id} timed out {attempts} times, giving up")
+            await _update(job_id, status="failed", error="Job timed out")
+        else:
+            logger.info(f"Job {job_id} missed its visibility deadline, requeueing")
+            await _update(job_id, status="queued", stage="queued")
+            await redis_client.lpush(QUEUE_KEY, job_id)
+
+
+async def _promote_delayed():
+    """Queues the failed jobs that are due for another attempt."""
+    await cache.redis_client.eval(_PROMOTE_SCRIPT, 2, DELAYED_KEY, QUEUE_KEY, time.time())
+
+
+def _retry_delay(error: Exception, attempts: int) -> float:
+    """Jittered exponential backoff, but never sooner than the error's Retry-After."""
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    delay *= random.uniform(0.5, 1.0)
+    headers = getattr(error, "headers", None) or {}
+    try:
+        delay = max(delay, float(headers.get("Retry-After", 0)))
+    except ValueError:
+        pass
+    return delay
+
+
+async def _heartbeat(job_id: str):
+    """Keeps extending a running job's visibility deadline."""
+    while True:
+        await asyncio.sleep(JOB_VISIBILITY_TIMEOUT_SECONDS / 3)
+        await cache.redis_client.zadd(
+            PROCESSING_KEY, {job_id: time.time() + JOB_VISIBILITY_TIMEOUT_SECONDS}, xx=True
+        )
+
+
+async def _run_job(job_id: str):
+    redis_client = cache.redis_client
+    job = await get_job(job_id)
+    if job is None:
+        # Job expired while queued
+        await redis_client.zrem(PROCESSING_KEY, job_id)
+        return
+
+    attempts = await redis_client.hincrby(_job_key(job_id), "attempts", 1)
+    await _update(job_id, status="running", stage="starting", progress=5)
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+
+    async def on_progress(stage: str, percent: int):
+        await _update(job_id, stage=stage, progress=percent)
+
+    try:
+        video_id, target_lang = job["video_id"], job["target_lang"]
+        owner = await redis_client.hget(_job_key(job_id), "owner")
+        result = await run_summary_pipeline(
+            video_id, job["lang"], target_lang, on_progress=on_progress, user_id=owner
+        )
+        response = build_summary_response(video_id, result)
+        await redis_client.zrem(PROCESSING_KEY, job_id)
+        await _update(job_id, status="completed", stage="done", progress=100, result=json.dumps(response))
+
+        # Read the users only once the job shows as completed: anyone added
+        # after this sees it completed and records their own history (see enqueue_job)
+        for user_id in await redis_client.smembers(f"{_job_key(job_id)}:users"):
+            await record_history(user_id, video_id, target_lang, result)
+        logger.info(f"Job {job_id} completed")
+    except Exception as e:
+        await redis_client.zrem(PROCESSING_KEY, job_id)
+        # Client errors (e.g. no transcript and no audio) won't succeed on a retry
+        permanent = isinstance(e, HTTPException) and e.status_code < 500
+        error = e.detail if isinstance(e, HTTPException) else "An error occurred while processing this video"
+        if permanent or attempts >= JOB_MAX_ATTEMPTS:
+            logger.warning(f"Job {job_id} failed after {attempts} attempt(s): {e}")
+            await _update(job_id, status="failed", stage="failed", error=error)
+        else:
+            delay = _retry_delay(e, attempts)
+            logger.info(f"Job {job_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+            await _update(job_id, status="queued", stage="retry_wait", error=error)
+            await redis_client.zadd(DELAYED_KEY, {job_id: time.time() + delay})
+    finally:
+        heartbeat.cancel()
+
+
+async def _worker_loop(worker_no: int):
+    while True:
+        try:
+            if worker_no == 0:
+                await _requeue_expired()
+                await _promote_delayed()
+            job_id = await _claim()
+            if job_id is None:
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+                continue
+            await _run_job(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker {worker_no} error: {e}")
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+
+def jobs_available() -> bool:
+    return cache.redis_client is not None
+
+
+def start_workers():
+    """Starts the job worker pool (requires Redis)."""
+    if not jobs_available() or JOB_WORKERS <= 0:
+        logger.warning("Job workers NOT started - Redis missing or JOB_WORKERS=0")
+        return
+    for worker_no in range(JOB_WORKERS):
+        _worker_tasks.append(asyncio.create_task(_worker_loop(worker_no)))
+    logger.info(f"Started {JOB_WORKERS} job worker(s)")
+
+
+async def stop_workers():
+    """Stops the workers; jobs they were running are retried after their deadline."""
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
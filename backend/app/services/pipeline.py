@@ -0,0 +1,410 @@
+"""
+Summarization Pipeline.
+The stages behind GET /transcript/{video_id}:
+1. Metadata and transcript are fetched concurrently, each with its own timeout.
+   Transcripts come through the hedged extractor router.
+2. The summary starts as soon as the transcript is ready. It waits only a short
+   grace period for the video description (and not at all on a cache hit).
+3. Videos without a usable transcript fall back to audio summarization.
+
+Summaries that miss the cache go through a fair scheduler: a fixed number run
+at once, and waiting ones are ordered by weighted fair queuing across users on
+their estimated cost (transcript length, or video duration for audio), so one
+user's batch of long lectures doesn't hold up everyone else's short videos.
+
+stream_summary_events() runs the same stages but reports each one as it
+finishes, streaming the summary fields while Gemini is still writing them.
+"""
+import asyncio
+import logging
+from fastapi import HTTPException
+from app.core import metrics
+from app.core.cache import get_cached_or_fetch, get_many_cached, peek_cached
+from app.core.concurrency import FairScheduler
+from app.core.config import (
+    SUMMARY_SCHEDULER_SLOTS,
+    METADATA_STAGE_TIMEOUT_SECONDS,
+    TRANSCRIPT_STAGE_TIMEOUT_SECONDS,
+    METADATA_GRACE_SECONDS,
+    SUMMARY_SOFT_TTL_SECONDS,
+    SUMMARY_HARD_TTL_SECONDS,
+)
+from app.db import crud, history_writer
+from app.services.youtube import get_video_metadata, get_safe_metadata
+from app.services.transcript import transcript_cache_key, get_prompt_text
+from app.services.extractors.router import fetch_transcript
+from app.services.gemini import (
+    generate_structured_summary,
+    generate_summary_from_audio,
+    stream_structured_summary,
+    needs_chunking,
+)
+from app.services.audio import acquire_audio, release_audio
+from app.utils.helpers import format_transcript, parse_gemini_response, IncrementalJsonFields
+
+logger = logging.getLogger(__name__)
+
+# Scheduler cost units: about ten minutes of speech, which is roughly 10k transcript characters
+COST_CHARS_PER_UNIT = 10000
+COST_SECONDS_PER_UNIT = 600
+# Queue for work done without a signed-in user
+ANONYMOUS_USER = "anonymous"
+
+summary_scheduler = FairScheduler(SUMMARY_SCHEDULER_SLOTS)
+metrics.register_gauge("summary_scheduler.running", lambda: summary_scheduler.running)
+metrics.register_gauge("summary_scheduler.queued", lambda: summary_scheduler.queued)
+
+
+def _transcript_cost(transcript_str: str) -> float:
+    return max(len(transcript_str) / COST_CHARS_PER_UNIT, 0.1)
+
+
+def _audio_cost(metadata: dict) -> float:
+    # Unknown duration counts as one unit
+    return max((metadata.get("duration_seconds") or COST_SECONDS_PER_UNIT) / COST_SECONDS_PER_UNIT, 0.1)
+
+
+async def _scheduled_summary(user_id: str | None, transcript_str: str, description: str, target_lang: str) -> dict:
+    async with summary_scheduler.slot(user_id or ANONYMOUS_USER, _transcript_cost(transcript_str)):
+        return await generate_structured_summary(transcript_str, description, target_lang)
+
+
+async def _streamed_summary(
+    fields: asyncio.Queue, user_id: str | None, transcript_str: str, description: str, target_lang: str
+) -> dict:
+    """
+    Streams the summary from Gemini, putting each (field, value) on 'fields' as
+    soon as it is complete. Runs as a shared cache fetch, so it never waits for
+    the client reading 'fields' and frees its slots as soon as Gemini is done.
+    """
+    parser = IncrementalJsonFields()
+    async with summary_scheduler.slot(user_id or ANONYMOUS_USER, _transcript_cost(transcript_str)):
+        async for chunk in stream_structured_summary(transcript_str, description, target_lang):
+            for field in parser.feed(chunk):
+                fields.put_nowait(field)
+    return parse_gemini_response(parser.buffer)
+
+
+async def _metadata_stage(video_id: str) -> dict:
+    try:
+        return await asyncio.wait_for(get_video_metadata(video_id), METADATA_STAGE_TIMEOUT_SECONDS) or {}
+    except asyncio.TimeoutError:
+        logger.warning(f"Metadata stage timed out for video {video_id}")
+        return {}
+
+
+async def _transcript_stage(video_id: str, lang: str) -> tuple[list[dict], str]:
+    # The fetch itself is shared through the cache, so timing out here only stops our wait
+    return await asyncio.wait_for(
+        get_cached_or_fetch(
+            transcript_cache_key(video_id, lang),
+            fetch_transcript,
+            video_id,
+            lang,
+            ttl=86400,
+            durable=True,
+        ),
+        TRANSCRIPT_STAGE_TIMEOUT_SECONDS,
+    )
+
+
+async def _transcript_or_none(transcript_stage) -> tuple[list[dict], str] | None:
+    """
+    Awaits the transcript stage. Returns None only if the video has no transcript,
+    the one case the audio fallback is for; timeouts and other errors are raised.
+    """
+    try:
+        return await transcript_stage
+    except asyncio.TimeoutError as e:
+        raise HTTPException(
+            status_code=504, detail="Fetching the transcript timed out, please try again"
+        ) from e
+    except HTTPException as e:
+        if e.status_code == 404:
+            return None
+        raise
+
+
+async def _description_within_grace(metadata_task: asyncio.Task) -> str:
+    """Returns the video description, or "" if metadata isn't ready within the grace period."""
+    try:
+        metadata = await asyncio.wait_for(asyncio.shield(metadata_task), METADATA_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        logger.info("Metadata still pending, summarizing without the video description")
+        return ""
+    return metadata.get("description", "")
+
+
+async def _summarize_transcript(
+    video_id: str,
+    lang: str,
+    transcript_data: list[dict],
+    metadata_task: asyncio.Task,
+    target_lang: str,
+    user_id: str | None,
+) -> dict:
+    # Only runs on a summary cache miss, so hits never build the prompt text.
+    # This fetch is shared by every request waiting on the summary: 'metadata_task'
+    # must never be cancelled by the request that created it.
+    transcript_str = await get_prompt_text(video_id, lang, transcript_data)
+    description = await _description_within_grace(metadata_task)
+    return await _scheduled_summary(user_id, transcript_str, description, target_lang)
+
+
+async def _summarize_audio(video_id: str, metadata: dict, target_lang: str, user_id: str | None) -> dict:
+    # Only runs on a summary cache miss, so cached audio summaries never touch the audio
+    audio_path = await acquire_audio(video_id)
+    if not audio_path:
+        raise HTTPException(status_code=404, detail="No transcript available and audio download failed.")
+    try:
+        async with summary_scheduler.slot(user_id or ANONYMOUS_USER, _audio_cost(metadata)):
+            return await generate_summary_from_audio(audio_path, metadata.get("description", ""), target_lang)
+    finally:
+        release_audio(video_id)
+
+
+async def _process_audio_fallback(
+    video_id: str, target_lang: str, metadata: dict, user_id: str | None = None
+) -> tuple[dict, list]:
+    """Helper to download and process audio when transcript is missing."""
+    structured_data = await get_cached_or_fetch(
+        f"summary_audio:{video_id}:{target_lang}",
+        _summarize_audio,
+        video_id,
+        metadata,
+        target_lang,
+        user_id,
+        ttl=86400,
+        durable=True,
+    )
+
+    transcript_data = [{"start": 0, "duration": 0, "text": "Transcript not available. Summary generated from audio."}]
+    return structured_data, transcript_data
+
+
+def build_summary_response(video_id: str, result: dict) -> dict:
+    """Shapes a pipeline result into the /transcript response body."""
+    formatted_transcript = format_transcript(result["transcript_data"])
+    return {
+        "video_id": video_id,
+        "language": result["language"],
+        "full_transcript": formatted_transcript,
+        "total_segments": len(formatted_transcript),
+        "metadata": get_safe_metadata(video_id, result["metadata"]),
+        **result["structured_data"],
+    }
+
+
+async def record_history(user_id: str, video_id: str, target_lang: str, result: dict):
+    """Queues a finished summary for the user's history (written in the background)."""
+    structured_data = result["structured_data"]
+    await history_writer.enqueue(crud.build_history_record(
+        user_id=user_id,
+        video_id=video_id,
+        title=structured_data.get("title", "Untitled Video"),
+        thumbnail=get_safe_metadata(video_id, result["metadata"])["thumbnail"],
+        language=target_lang,
+        full_data=structured_data
+    ))
+
+
+async def lookup_cached_results(video_ids: list[str], lang: str, target_lang: str, metadata: dict[str, dict]) -> dict[str, dict]:
+    """
+    Finds the videos whose transcript and summary are both cached, using two
+    batched cache lookups (transcripts first, since the summary key needs the
+    detected language). Returns pipeline results keyed by video id.
+    """
+    transcript_keys = {video_id: transcript_cache_key(video_id, lang) for video_id in video_ids}
+    transcripts = await get_many_cached(list(transcript_keys.values()), durable=True)
+
+    summary_keys = {}
+    for video_id in video_ids:
+        cached = transcripts.get(transcript_keys[video_id])
+        if cached:
+            summary_keys[video_id] = f"summary:{video_id}:{cached[1]}:{target_lang}"
+    summaries = await get_many_cached(list(summary_keys.values()), durable=True)
+
+    results = {}
+    for video_id, summary_key in summary_keys.items():
+        if summary_key not in summaries:
+            continue
+        transcript_data, detected_lang = transcripts[transcript_keys[video_id]]
+        results[video_id] = {
+            "metadata": metadata.get(video_id, {}),
+            "language": detected_lang,
+            "transcript_data": transcript_data,
+            "structured_data": summaries[summary_key],
+        }
+    return results
+
+
+async def _report(on_progress, stage: str, percent: int):
+    if on_progress:
+        try:
+            await on_progress(stage, percent)
+        except Exception as e:
+            logger.warning(f"Progress callback failed at stage {stage}: {e}")
+
+
+async def run_summary_pipeline(
+    video_id: str, lang: str, target_lang: str, on_progress=None, user_id: str | None = None
+) -> dict:
+    """
+    Produces everything the summary endpoint needs for one video.
+    Returns a dict with 'metadata' (raw), 'language', 'transcript_data' and 'structured_data'.
+    'on_progress', if given, is awaited as on_progress(stage, percent) between stages.
+    'user_id' is who the work is scheduled for.
+    """
+    # Not cancelled if we go away: a shared summary fetch may be using it, and it
+    # ends on its own within METADATA_STAGE_TIMEOUT_SECONDS
+    metadata_task = asyncio.create_task(_metadata_stage(video_id))
+    await _report(on_progress, "transcript", 10)
+    transcript = await _transcript_or_none(_transcript_stage(video_id, lang))
+
+    if transcript is not None:
+        transcript_data, detected_lang = transcript
+        await _report(on_progress, "summary", 40)
+        structured_data = await get_cached_or_fetch(
+            f"summary:{video_id}:{detected_lang}:{target_lang}",
+            _summarize_transcript,
+            video_id,
+            lang,
+            transcript_data,
+            metadata_task,
+            target_lang,
+            user_id,
+            ttl=SUMMARY_HARD_TTL_SECONDS,
+            soft_ttl=SUMMARY_SOFT_TTL_SECONDS,
+            durable=True,
+        )
+        metadata = await metadata_task
+    else:
+        logger.info(f"No transcript found for {video_id}. Falling back to audio processing.")
+        detected_lang = lang if lang != "auto" else "English"
+
+        metadata = await metadata_task
+        await _report(on_progress, "audio_fallback", 30)
+        structured_data, transcript_data = await _process_audio_fallback(
+            video_id, target_lang, metadata, user_id
+        )
+
+    return {
+        "metadata": metadata,
+        "language": detected_lang,
+        "transcript_data": transcript_data,
+        "structured_data": structured_data,
+    }
+
+
+async def stream_summary_events(video_id: str, lang: str, target_lang: str, user_id: str):
+    """
+    Streaming variant of the pipeline for SSE. Yields (event, data) pairs in order:
+    'metadata', 'transcript', one 'summary_field' per summary field, then 'done'.
+    Cached summaries are sent straight away. Errors are reported as an 'error' event.
+    """
+    metadata_task = asyncio.create_task(_metadata_stage(video_id))
+    transcript_task = asyncio.create_task(_transcript_stage(video_id, lang))
+    try:
+        metadata = await metadata_task
+        yield "metadata", get_safe_metadata(video_id, metadata)
+
+        transcript = await _transcript_or_none(transcript_task)
+        if transcript is None:
+            logger.info(f"No transcript found for {video_id}. Falling back to audio processing.")
+            detected_lang = lang if lang != "auto" else "English"
+            structured_data, transcript_data = await _process_audio_fallback(
+                video_id, target_lang, metadata, user_id
+            )
+        else:
+            transcript_data, detected_lang = transcript
+            structured_data = None
+
+        yield "transcript", {"language": detected_lang, "segments": format_transcript(transcript_data)}
+
+        summary_key = f"summary:{video_id}:{detected_lang}:{target_lang}"
+        if structured_data is None:
+            # Same key, tiers and refresh as the non-streaming pipeline; only a miss is streamed
+            structured_data = await peek_cached(
+                summary_key,
+                _summarize_transcript,
+                video_id,
+                lang,
+                transcript_data,
+                metadata_task,
+                target_lang,
+                user_id,
+                ttl=SUMMARY_HARD_TTL_SECONDS,
+                soft_ttl=SUMMARY_SOFT_TTL_SECONDS,
+                durable=True,
+            )
+
+        if structured_data is not None:
+            for field, value in structured_data.items():
+                yield "summary_field", {"field": field, "value": value}
+        else:
+            transcript_str = await get_prompt_text(video_id, lang, transcript_data)
+            description = metadata.get("description", "")
+            if needs_chunking(transcript_str):
+                # Map-reduce summaries only exist once the reduce step is done
+                structured_data = await get_cached_or_fetch(
+                    summary_key,
+                    _scheduled_summary,
+                    user_id,
+                    transcript_str,
+                    description,
+                    target_lang,
+                    ttl=SUMMARY_HARD_TTL_SECONDS,
+                    soft_ttl=SUMMARY_SOFT_TTL_SECONDS,
+                    durable=True,
+                )
+                for field, value in structured_data.items():
+                    yield "summary_field", {"field": field, "value": value}
+            else:
+                # Streamed through the usual single-flight fetch: only the request
+                # that runs it gets fields as they arrive, the others (here or on
+                # other workers) wait for the cached summary and get it all at once
+                fields = asyncio.Queue()
+                summary = asyncio.ensure_future(get_cached_or_fetch(
+                    summary_key,
+                    _streamed_summary,
+                    fields,
+                    user_id,
+                    transcript_str,
+                    description,
+                    target_lang,
+                    ttl=SUMMARY_HARD_TTL_SECONDS,
+                    soft_ttl=SUMMARY_SOFT_TTL_SECONDS,
+                    durable=True,
+                ))
+                summary.add_done_callback(lambda _: fields.put_nowait(None))
+                sent = set()
+                try:
+                    while (item := await fields.get()) is not None:
+                        field, value = item
+                        sent.add(field)
+                        yield "summary_field", {"field": field, "value": value}
+                    structured_data = await summary
+                finally:
+                    # The fetch itself is shielded and carries on for its other waiters
+                    summary.cancel()
+                for field, value in structured_data.items():
+                    if field not in sent:
+                        yield "summary_field", {"field": field, "value": value}
+
+        result = {
+            "metadata": metadata,
+            "language": detected_lang,
+            "transcript_data": transcript_data,
+            "structured_data": structured_data,
+        }
+        await record_history(user_id, video_id, target_lang, result)
+        yield "done", {"video_id": video_id, "language": detected_lang, "total_segments": len(transcript_data)}
+    except HTTPException as e:
+        yield "error", {"detail": e.detail}
+    except Exception:
+        logger.exception(f"Unexpected error streaming summary for video {video_id}")
+        yield "error", {"detail": "An error occurred while processing your request"}
+    finally:
+        for task in (metadata_task, transcript_task):
+            if not task.done():
+                task.cancel()
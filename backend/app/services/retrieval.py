@@ -0,0 +1,113 @@
+"""
+Transcript Retrieval for Chat.
+Instead of pasting the whole transcript into every chat prompt, the transcript
+is cut into overlapping time windows and indexed with BM25 once per video.
+Each question then only sends the best matching windows (with their times).
+"""
+import math
+import re
+from collections import Counter
+from app.core.config import (
+    CHAT_WINDOW_SECONDS,
+    CHAT_WINDOW_OVERLAP_SECONDS,
+    CHAT_TOP_K,
+    CHAT_MIN_TERM_COVERAGE,
+)
+from app.services.compaction import dedupe_rolling_captions
+from app.utils.helpers import format_timestamp
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "but", "by", "can", "did", "do",
+    "does", "for", "from", "he", "how", "i", "if", "in", "is", "it", "its", "me", "my",
+    "of", "on", "or", "she", "so", "that", "the", "their", "them", "they", "this", "to",
+    "video", "was", "we", "what", "when", "where", "which", "who", "why", "with", "you",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS and len(token) > 1]
+
+
+def build_chat_index(transcript_data: list[dict]) -> dict:
+    """
+    Groups segments into overlapping windows of CHAT_WINDOW_SECONDS and builds
+    the BM25 statistics. The result is plain JSON so it can be cached.
+    """
+    transcript_data = dedupe_rolling_captions(transcript_data)
+    step = max(CHAT_WINDOW_SECONDS - CHAT_WINDOW_OVERLAP_SECONDS, 1)
+    windows = []
+    if transcript_data:
+        end_of_video = max(seg["start"] + seg.get("duration", 0) for seg in transcript_data)
+        window_start = 0.0
+        first = 0
+        while window_start <= end_of_video:
+            window_end = window_start + CHAT_WINDOW_SECONDS
+            # Segments are in time order, so skip the ones that ended before this window
+            while first < len(transcript_data) and transcript_data[first]["start"] < window_start:
+                first += 1
+            texts = []
+            for seg in transcript_data[first:]:
+                if seg["start"] >= window_end:
+                    break
+                texts.append(seg["text"])
+            if texts:
+                windows.append({"start": window_start, "end": window_end, "text": " ".join(texts)})
+            window_start += step
+
+    term_freqs = [Counter(tokenize(window["text"])) for window in windows]
+    doc_freq = Counter(term for freqs in term_freqs for term in freqs)
+    lengths = [sum(freqs.values()) for freqs in term_freqs]
+    return {
+        "windows": windows,
+        "term_freqs": [dict(freqs) for freqs in term_freqs],
+        "lengths": lengths,
+        "doc_freq": dict(doc_freq),
+        "avg_length": (sum(lengths) / len(lengths)) if lengths else 0.0,
+    }
+
+
+def select_context(index: dict, question: str, top_k: int = CHAT_TOP_K) -> str | None:
+    """
+    Returns the top_k windows for a question as timestamped text (in video order),
+    or None when retrieval isn't confident enough and the full transcript should be used.
+    """
+    query_terms = set(tokenize(question))
+    windows = index["windows"]
+    if not query_terms or not windows:
+        return None
+
+    total = len(windows)
+    avg_length = index["avg_length"] or 1.0
+    idf = {
+        term: math.log(1 + (total - index["doc_freq"].get(term, 0) + 0.5) / (index["doc_freq"].get(term, 0) + 0.5))
+        for term in query_terms
+    }
+
+    scores = []
+    for i, freqs in enumerate(index["term_freqs"]):
+        norm = K1 * (1 - B + B * index["lengths"][i] / avg_length)
+        score = sum(
+            idf[term] * freqs[term] * (K1 + 1) / (freqs[term] + norm)
+            for term in query_terms
+            if term in freqs
+        )
+        if score > 0:
+            scores.append((score, i))
+    if not scores:
+        return None
+
+    best = sorted(scores, reverse=True)[:top_k]
+    matched_terms = {term for _, i in best for term in query_terms if term in index["term_freqs"][i]}
+    if len(matched_terms) / len(query_terms) < CHAT_MIN_TERM_COVERAGE:
+        return None
+
+    return "\n\n".join(
+        f"[{format_timestamp(windows[i]['start'])} - {format_timestamp(windows[i]['end'])}]\n{windows[i]['text']}"
+        for i in sorted(i for _, i in best)
+    )
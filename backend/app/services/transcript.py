@@ -0,0 +1,153 @@
+"""
+YouTube Transcript Service.
+Fetches caption tracks through 'youtube_transcript_api' and normalizes them
+into plain {"text", "start", "duration"} dictionaries.
+"""
+import logging
+import os
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from youtube_transcript_api import (
+    AgeRestricted,
+    InvalidVideoId,
+    NoTranscriptFound,
+    TranscriptsDisabled,
+    VideoUnavailable,
+    VideoUnplayable,
+)
+from app.core.cache import get_derived
+from app.core.retry import retry_policy
+from app.core.config import (
+    TRANSCRIPT_COMPACT_WINDOW_SECONDS,
+    TRANSCRIPT_COMPACT_MAX_WINDOW_SECONDS,
+    TRANSCRIPT_PROMPT_CHAR_BUDGET,
+)
+from app.services.compaction import compact_transcript
+
+logger = logging.getLogger(__name__)
+
+# Answers about the video itself rather than failures of the fetch
+_NO_TRANSCRIPT_ERRORS = (
+    NoTranscriptFound,
+    TranscriptsDisabled,
+    VideoUnavailable,
+    VideoUnplayable,
+    AgeRestricted,
+    InvalidVideoId,
+)
+
+
+class TranscriptUnavailable(HTTPException):
+    """The video has no (matching) transcript - as opposed to the fetch failing."""
+
+    def __init__(self):
+        super().__init__(status_code=404, detail="Transcript unavailable for this video")
+
+
+def transcript_cache_key(video_id: str, lang: str) -> str:
+    return f"transcript:{video_id}:{lang}"
+
+
+def format_transcript_for_prompt(transcript_data: list[dict]) -> str:
+    """The timestamped transcript text that goes into Gemini prompts (compacted to fit the budget)."""
+    return compact_transcript(transcript_data)
+
+
+async def get_prompt_text(video_id: str, lang: str, transcript_data: list[dict]) -> str:
+    """
+    Prompt-ready transcript text, built once per (video_id, lang) and cached
+    next to the transcript so the summary and chat endpoints share it.
+    """
+    # The compaction settings are part of the name so changing them rebuilds the text
+    name = (
+        f"prompt_text:{TRANSCRIPT_COMPACT_WINDOW_SECONDS}:"
+        f"{TRANSCRIPT_COMPACT_MAX_WINDOW_SECONDS}:{TRANSCRIPT_PROMPT_CHAR_BUDGET}"
+    )
+    return await get_derived(
+        transcript_cache_key(video_id, lang),
+        name,
+        format_transcript_for_prompt,
+        transcript_data,
+        ttl=86400,
+    )
+
+
+@retry_policy("transcript", attempts=3, min_wait=1, max_wait=4)
+async def _fetch_transcript_once(video_id: str, lang: str) -> tuple[list[dict], str]:
+    cookies_path = os.path.join(os.getcwd(), "youtube_cookies.txt")
+
+    # Manually handle cookies since the library version has them disabled
+    session = None
+    if os.path.exists(cookies_path):
+        logger.info(f"Loading cookies from {cookies_path}")
+        import requests
+        from http.cookiejar import MozillaCookieJar
+
+        session = requests.Session()
+        cj = MozillaCookieJar(cookies_path)
+        try:
+            cj.load(ignore_discard=True, ignore_expires=True)
+            session.cookies = cj  # type: ignore
+            logger.info("Cookies loaded successfully into session")
+        except Exception as e:
+            logger.error(f"Failed to load cookies: {e}")
+            session = None
+
+    # Initialize the API with our custom session if we have one
+    from youtube_transcript_api import YouTubeTranscriptApi
+    ytt_api = YouTubeTranscriptApi(http_client=session)
+
+    # Use the instance method 'list' instead of class method 'list_transcripts'
+    transcript_list = await run_in_threadpool(ytt_api.list, video_id)
+
+    if lang == "auto":
+        try:
+            # Try English first (manual then auto-generated)
+            transcript_obj = transcript_list.find_transcript(["en"])
+        except NoTranscriptFound:
+            # Fallback to the first available transcript
+            transcript_obj = next(iter(transcript_list))
+    else:
+        transcript_obj = transcript_list.find_transcript([lang])
+
+    # Fetch the raw content
+    raw_data = await run_in_threadpool(transcript_obj.fetch)
+
+    # CRITICAL: Ensure we have plain dictionaries for JSON serialization
+    clean_data = []
+    for seg in raw_data:
+        # Handle both dict-like and object-like segments
+        if isinstance(seg, dict):
+            text = seg.get("text", "")
+            start = seg.get("start", 0.0)
+            duration = seg.get("duration", 0.0)
+        else:
+            text = getattr(seg, "text", getattr(seg, "__getitem__", lambda x: "")("text"))
+            start = getattr(seg, "start", getattr(seg, "__getitem__", lambda x: 0.0)("start"))
+            duration = getattr(seg, "duration", getattr(seg, "__getitem__", lambda x: 0.0)("duration"))
+
+        clean_data.append({
+            "text": str(text),
+            "start": float(start),
+            "duration": float(duration)
+        })
+
+    return clean_data, str(transcript_obj.language_code)
+
+
+async def fetch_youtube_transcript(video_id: str, lang: str = "en") -> tuple[list[dict], str]:
+    """
+    Directly interacts with the 'youtube_transcript_api' library.
+    Tries to find the requested language, or falls back to English/Auto.
+    Network errors are retried; a video without a matching transcript fails at once.
+    """
+    try:
+        return await _fetch_transcript_once(video_id, lang)
+    except _NO_TRANSCRIPT_ERRORS as e:
+        logger.info(f"No transcript for video {video_id}: {type(e).__name__}")
+        raise TranscriptUnavailable()
+    except Exception as e:
+        logger.warning(f"Transcript fetch failed for video {video_id}: {str(e)}")
+        raise HTTPException(
+            status_code=404, detail="Transcript unavailable for this video"
+        )
@@ -2,57 +2,80 @@
 YouTube Data API Service.
 Fetches video metadata like title, duration, and channel information.
 """
+import asyncio
 import logging
 import httpx
-from app.core.config import YOUTUBE_API_KEY
+from app.core.cache import get_cached_or_fetch, get_many_cached, set_cached
+from app.core.config import YOUTUBE_API_KEY, METADATA_CACHE_TTL_SECONDS
+from app.core.http_client import get_http_client
 from app.utils.helpers import iso8601_to_seconds
 
 logger = logging.getLogger(__name__)
 
+YOUTUBE_VIDEOS_URL = "https://www.googleapis.com/youtube/v3/videos"
+# videos.list accepts at most 50 comma-separated ids per call
+YOUTUBE_MAX_IDS_PER_CALL = 50
+
+
+class MetadataUnavailable(Exception):
+    """Raised when the YouTube API can't give us metadata (these results are not cached)."""
+
+
+def _parse_video_item(item: dict) -> dict:
+    """Turns one 'videos.list' item into our metadata dict."""
+    # Check if video is embeddable or has restrictions
+    status = item.get("status", {})
+    if not status.get("embeddable", True):
+        logger.info(f"Video {item.get('id')} is not embeddable")
+
+    duration_iso = item["contentDetails"]["duration"]
+    duration_seconds = iso8601_to_seconds(duration_iso)
+
+    return {
+        "channel": item["snippet"]["channelTitle"],
+        "duration_seconds": duration_seconds,
+        "published_at": item["snippet"]["publishedAt"],
+        "title": item["snippet"]["title"],
+        "description": item["snippet"].get("description", ""),
+        "thumbnail": item["snippet"]["thumbnails"].get("maxres", item["snippet"]["thumbnails"].get("high", item["snippet"]["thumbnails"].get("default")))["url"],
+        "is_embeddable": status.get("embeddable", True)
+    }
+
+
+async def _fetch_video_metadata(video_id: str) -> dict:
+    response = await get_http_client().get(
+        YOUTUBE_VIDEOS_URL,
+        params={
+            "part": "snippet,contentDetails,status",
+            "id": video_id,
+            "key": YOUTUBE_API_KEY,
+        },
+    )
+
+    if response.status_code != 200:
+        if response.status_code == 403:
+            logger.error("YouTube API quota exceeded or key invalid")
+        raise MetadataUnavailable(f"YouTube API returned status {response.status_code}")
+
+    data = response.json()
+    if not data.get("items"):
+        raise MetadataUnavailable("no items (might be private or deleted)")
+
+    return _parse_video_item(data["items"][0])
+
 
 async def get_video_metadata(video_id: str) -> dict:
     """Uses the Google YouTube Data API v3 to get detailed info about a video."""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                "https://www.googleapis.com/youtube/v3/videos",
-                params={
-                    "part": "snippet,contentDetails,status",
-                    "id": video_id,
-                    "key": YOUTUBE_API_KEY,
-                },
-            )
-
-        if response.status_code != 200:
-            if response.status_code == 403:
-                logger.error("YouTube API quota exceeded or key invalid")
-            logger.warning(f"YouTube API returned status {response.status_code} for video {video_id}")
-            return {}
-
-        data = response.json()
-        if not data.get("items"):
-            logger.info(f"No metadata found for video {video_id} (might be private or deleted)")
-            return {}
-
-        item = data["items"][0]
-        
-        # Check if video is embeddable or has restrictions
-        status = item.get("status", {})
-        if not status.get("embeddable", True):
-            logger.info(f"Video {video_id} is not embeddable")
-
-        duration_iso = item["contentDetails"]["duration"]
-        duration_seconds = iso8601_to_seconds(duration_iso)
-
-        return {
-            "channel": item["snippet"]["channelTitle"],
-            "duration_seconds": duration_seconds,
-            "published_at": item["snippet"]["publishedAt"],
-            "title": item["snippet"]["title"],
-            "description": item["snippet"].get("description", ""),
-            "thumbnail": item["snippet"]["thumbnails"].get("maxres", item["snippet"]["thumbnails"].get("high", item["snippet"]["thumbnails"].get("default")))["url"],
-            "is_embeddable": status.get("embeddable", True)
-        }
+        return await get_cached_or_fetch(
+            f"metadata:{video_id}",
+            _fetch_video_metadata,
+            video_id,
+            ttl=METADATA_CACHE_TTL_SECONDS,
+        )
+    except MetadataUnavailable as e:
+        logger.warning(f"No metadata for video {video_id}: {e}")
+        return {}
     except httpx.TimeoutException:
         logger.warning(f"Timeout fetching metadata for video {video_id}")
         return {}
@@ -61,6 +84,56 @@ async def get_video_metadata(video_id: str) -> dict:
         return {}
 
 
+async def get_videos_metadata(video_ids: list[str]) -> dict[str, dict]:
+    """
+    Metadata for many videos: cached entries come from one batched cache lookup,
+    the rest from 'videos.list' calls of up to 50 ids each (1 quota unit per call).
+    Videos without metadata are missing from the result.
+    """
+    cached = await get_many_cached([f"metadata:{video_id}" for video_id in video_ids])
+    result = {video_id: cached[f"metadata:{video_id}"] for video_id in video_ids if f"metadata:{video_id}" in cached}
+    missing = [video_id for video_id in video_ids if video_id not in result]
+
+    for i in range(0, len(missing), YOUTUBE_MAX_IDS_PER_CALL):
+        chunk = missing[i:i + YOUTUBE_MAX_IDS_PER_CALL]
+        try:
+            response = await get_http_client().get(
+                YOUTUBE_VIDEOS_URL,
+                params={
+                    "part": "snippet,contentDetails,status",
+                    "id": ",".join(chunk),
+                    "key": YOUTUBE_API_KEY,
+                    "maxResults": YOUTUBE_MAX_IDS_PER_CALL,
+                },
+            )
+            if response.status_code != 200:
+                if response.status_code == 403:
+                    logger.error("YouTube API quota exceeded or key invalid")
+                logger.warning(f"YouTube API returned status {response.status_code} for batch of {len(chunk)} videos")
+                continue
+
+            fetched = {}
+            for item in response.json().get("items", []):
+                try:
+                    fetched[item["id"]] = _parse_video_item(item)
+                except (KeyError, TypeError) as e:
+                    logger.warning(f"Unexpected metadata shape for video {item.get('id')}: {e}")
+        except httpx.TimeoutException:
+            logger.warning(f"Timeout fetching metadata for batch of {len(chunk)} videos")
+            continue
+        except Exception as e:
+            logger.warning(f"Error fetching metadata for batch of {len(chunk)} videos: {e}")
+            continue
+
+        await asyncio.gather(*(
+            set_cached(f"metadata:{video_id}", metadata, ttl=METADATA_CACHE_TTL_SECONDS)
+            for video_id, metadata in fetched.items()
+        ))
+        result.update(fetched)
+
+    return result
+
+
 def get_safe_metadata(video_id: str, metadata: dict) -> dict:
     return {
         "duration": metadata.get("duration_seconds", 0),
@@ -57,3 +57,58 @@ def format_transcript(transcript: list) -> list:
         }
         for seg in transcript
     ]
+
+
+class IncrementalJsonFields:
+    """
+    Pulls top-level fields out of a JSON object while its text is still streaming in.
+    feed() returns the (key, value) pairs that became complete with the new chunk.
+    Anything before the first '{' (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = None
+        self._decoder = json.JSONDecoder()
+
+    def _skip(self, pos: int, chars: str) -> int:
+        while pos < len(self.buffer) and self.buffer[pos] in chars:
+            pos += 1
+        return pos
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        if self._pos is None:
+            start = self.buffer.find("{")
+            if start == -1:
+                return []
+            self._pos = start + 1
+
+        fields = []
+        while True:
+            pos = self._skip(self._pos, " \t\r\n,")
+            if pos >= len(self.buffer) or self.buffer[pos] == "}":
+                break
+            try:
+                key, pos = self._decoder.raw_decode(self.buffer, pos)
+                pos = self._skip(pos, " \t\r\n")
+                if pos >= len(self.buffer) or self.buffer[pos] != ":":
+                    break
+                value, pos = self._decoder.raw_decode(self.buffer, self._skip(pos + 1, " \t\r\n"))
+            except json.JSONDecodeError:
+                break
+            # Only trust the value once something follows it (a number could still be growing)
+            end = self._skip(pos, " \t\r\n")
+            if end >= len(self.buffer) or self.buffer[end] not in ",}":
+                break
+            fields.append((key, value))
+            self._pos = end
+        return fields
+
+
+def format_timestamp(seconds: float) -> str:
+    """Formats seconds as MM:SS (or H:MM:SS past one hour)."""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,91 @@
+"""
+Auth Event Loop Benchmark.
+Measures how much concurrent password checks delay the event loop (as every
+in-flight request and SSE stream on the worker sees it): bcrypt called inline
+in a coroutine vs through the bounded auth executor.
+
+Run from the backend directory:
+    python benchmarks/bench_auth_event_loop.py [--logins 20] [--rounds 12]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt  # noqa: E402
+
+TICK_SECONDS = 0.01
+
+
+async def measure_lag(stop: asyncio.Event) -> list:
+    """Sleeps for TICK_SECONDS in a loop and records how late each wake-up was."""
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+    return lags
+
+
+async def inline_login(password: str, hashed: str) -> bool:
+    # What crud.verify_user used to do
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+async def executor_login(password: str, hashed: str) -> bool:
+    from app.core import passwords  # imported by main() before measuring
+    return await passwords.verify_password(password, hashed)
+
+
+async def run(login, logins: int, hashed: str):
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(TICK_SECONDS * 5)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login("correct horse", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lags = await ticker
+    assert all(results)
+    return lags, elapsed
+
+
+def report(name: str, lags: list, elapsed: float):
+    ordered = sorted(lags)
+    p99 = ordered[int(0.99 * (len(ordered) - 1))]
+    print(
+        f"{name:<10} lag p50 {statistics.median(ordered) * 1000:8.1f} ms  "
+        f"p99 {p99 * 1000:8.1f} ms  max {ordered[-1] * 1000:8.1f} ms  "
+        f"(ticks {len(ordered)}, {elapsed:.2f}s for all logins)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=20, help="concurrent logins")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=2, help="auth executor threads")
+    args = parser.parse_args()
+
+    # The executor reads its settings at import time
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["AUTH_HASH_WORKERS"] = str(args.workers)
+    os.environ["AUTH_HASH_QUEUE_SIZE"] = str(args.logins)
+    # app.core.config insists on the API keys, which nothing here uses
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("YOUTUBE_API_KEY", "benchmark")
+    import app.core.passwords  # noqa: F401
+
+    hashed = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(rounds=args.rounds)).decode("utf-8")
+    print(f"{args.logins} concurrent logins, bcrypt cost {args.rounds}, {args.workers} executor threads\n")
+    for name, login in (("inline", inline_login), ("executor", executor_login)):
+        lags, elapsed = asyncio.run(run(login, args.logins, hashed))
+        report(name, lags, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Cache Codec Benchmark.
+Compares the legacy JSON cache format with the compact codec on a synthetic
+multi-hour transcript and a typical summary.
+
+Run from the backend directory:
+    python benchmarks/bench_cache_codec.py [--hours 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.codec import JsonCodec, CompactCodec, decode_sized, zstandard  # noqa: E402
+
+WORDS = (
+    "so the idea here is that we want to take this function and make it run "
+    "faster by caching the result of the expensive call which means that every "
+    "request after the first one is basically free right and that is the point"
+).split()
+
+
+def make_transcript(hours: float) -> list:
+    rng = random.Random(42)
+    segments, start = [], 0.0
+    while start < hours * 3600:
+        duration = round(rng.uniform(1.5, 4.0), 3)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 12)))
+        segments.append({"text": text, "start": round(start, 3), "duration": duration})
+        start += duration
+    return [segments, "en"]
+
+
+def make_summary() -> dict:
+    return {
+        "title": "How Caching Makes Everything Faster",
+        "summary": " ".join(WORDS * 3),
+        "key_topics": [{"topic": f"Topic {i}", "timestamp": f"{i * 7:02d}:00"} for i in range(12)],
+        "actionable_insights": [f"Insight {i}: " + " ".join(WORDS[:20]) for i in range(5)],
+    }
+
+
+def bench(label: str, codec, value, rounds: int):
+    payload, _ = codec.encode_sized(value)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        codec.encode_sized(value)
+    encode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decoded, _ = decode_sized(payload)
+    decode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    assert json.loads(json.dumps(decoded)) == json.loads(json.dumps(value)), "round trip mismatch"
+    print(f"{label:<28} {len(payload):>12,} B {encode_ms:>10.2f} ms {decode_ms:>10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=3.0)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    transcript = make_transcript(args.hours)
+    summary = make_summary()
+    codecs = [
+        ("json", JsonCodec()),
+        ("compact+zlib", CompactCodec(compression="zlib")),
+        ("compact+zstd", CompactCodec(compression="zstd")),
+    ]
+
+    print(f"Transcript: {len(transcript[0]):,} segments ({args.hours:g}h)")
+    if zstandard is None:
+        print("Note: 'zstandard' is not installed, compact+zstd falls back to zlib")
+    print(f"{'codec':<28} {'size':>14} {'encode':>13} {'decode':>13}")
+    for name, codec in codecs:
+        bench(f"transcript/{name}", codec, transcript, args.rounds)
+    for name, codec in codecs:
+        bench(f"summary/{name}", codec, summary, args.rounds * 50)
+
+
+if __name__ == "__main__":
+    main()